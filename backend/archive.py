@@ -0,0 +1,267 @@
+"""Hot/cold tiering for expenses.
+
+Whole months older than the archive horizon are moved out of ``expenses``,
+either into the ``expenses_archive`` collection or into gzipped JSONL files
+under ARCHIVE_DIR. Rollups are left untouched so dashboards and analytics
+still answer for archived periods. The manifest records, per user and month,
+where the rows went plus per-(day, category) totals so rollup rebuilds and
+checks can account for rows that no longer live in ``expenses``.
+
+Each batch is made durable and counted in the manifest as its own part
+before its rows are deleted from ``expenses``, and the part is marked done
+after the delete. A run that stops in between leaves parts that are not
+done; the next run for that month deletes their rows first, so nothing is
+lost or counted twice. Rows copied by a part that never reached the manifest
+are simply archived again.
+
+    python archive.py [horizon_days] [collection|files]
+"""
+import asyncio
+import gzip
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import quote
+
+import orjson
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReplaceOne
+
+ARCHIVE_COLLECTION = "expenses_archive"
+MANIFEST_COLLECTION = "archive_manifest"
+BATCH_SIZE = 5000
+
+
+def _month_bounds(month):
+    start = datetime.strptime(month, "%Y-%m").date()
+    end = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start.isoformat(), end.isoformat()
+
+
+def _manifest_id(user_id, month):
+    return "{}|{}".format(user_id, month)
+
+
+async def ensure_indexes(db):
+    await db[ARCHIVE_COLLECTION].create_index([("user_id", ASCENDING), ("date", ASCENDING)])
+    # A rerun after a crash overwrites rows it already copied instead of copying them twice
+    await db[ARCHIVE_COLLECTION].create_index([("user_id", ASCENDING), ("id", ASCENDING)], unique=True)
+    await db[MANIFEST_COLLECTION].create_index([("user_id", ASCENDING), ("month", ASCENDING)])
+
+
+def _write_file(path, payload):
+    with open(path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            f.write(payload)
+        raw.flush()
+        os.fsync(raw.fileno())
+    # The new directory entry has to survive a crash as well as the file contents
+    directory = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class _FileSink:
+    """One gzipped JSONL file per part, synced to disk before write returns."""
+
+    def __init__(self, archive_dir, user_id, month):
+        self.directory = Path(archive_dir) / quote(user_id, safe="")
+        self.month = month
+
+    async def write(self, docs, part_id):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / "{}-{}.jsonl.gz".format(self.month, part_id)
+        payload = b"".join(orjson.dumps(doc) + b"\n" for doc in docs)
+        await asyncio.to_thread(_write_file, path, payload)
+        return {"type": "file", "path": str(path)}
+
+
+class _CollectionSink:
+    def __init__(self, db):
+        self.db = db
+
+    async def write(self, docs, part_id):
+        # Acknowledged by the server before returning; rows are tagged with their part for recovery
+        await self.db[ARCHIVE_COLLECTION].bulk_write([
+            ReplaceOne({"user_id": doc['user_id'], "id": doc['id']}, {**doc, "archive_part": part_id}, upsert=True)
+            for doc in docs
+        ], ordered=False)
+        return {"type": "collection", "collection": ARCHIVE_COLLECTION}
+
+
+async def _part_ids(db, part):
+    if part['type'] == "file":
+        lines = await asyncio.to_thread(lambda: list(_read_file_lines(part['path'])))
+        return [orjson.loads(line)['id'] for line in lines]
+    cursor = db[ARCHIVE_COLLECTION].find({"archive_part": part['id']}, {"_id": 0, "id": 1})
+    return [doc['id'] async for doc in cursor]
+
+
+async def _finish_parts(db, user_id, month):
+    # Parts counted in the manifest whose rows may still be in expenses: delete those rows now
+    manifest = await db[MANIFEST_COLLECTION].find_one({"_id": _manifest_id(user_id, month)}, {"parts": 1})
+    for part in (manifest or {}).get('parts', []):
+        if part.get('done', True):
+            continue
+        ids = await _part_ids(db, part)
+        for start in range(0, len(ids), BATCH_SIZE):
+            await db.expenses.delete_many({"user_id": user_id, "id": {"$in": ids[start:start + BATCH_SIZE]}})
+        await db[MANIFEST_COLLECTION].update_one(
+            {"_id": _manifest_id(user_id, month), "parts.id": part['id']}, {"$set": {"parts.$.done": True}}
+        )
+
+
+async def _archive_batch(db, user_id, month, sink, batch):
+    # Copy durably, count the copy in the manifest, and only then delete exactly the
+    # copied ids, so rows written concurrently into an old month are left for the next run
+    part_id = uuid.uuid4().hex
+    location = await sink.write(batch, part_id)
+    inc = {"count": len(batch), "total": 0.0}
+    for doc in batch:
+        inc["total"] += doc['amount']
+        key = "{}|{}".format(doc['date'], doc['category'])
+        inc["buckets.{}.total".format(key)] = inc.get("buckets.{}.total".format(key), 0.0) + doc['amount']
+        inc["buckets.{}.count".format(key)] = inc.get("buckets.{}.count".format(key), 0) + 1
+    await db[MANIFEST_COLLECTION].update_one(
+        {"_id": _manifest_id(user_id, month)},
+        {
+            "$set": {"user_id": user_id, "month": month},
+            "$inc": inc,
+            "$push": {"parts": {
+                **location, "id": part_id, "count": len(batch), "archived_at": datetime.utcnow(), "done": False
+            }}
+        },
+        upsert=True
+    )
+    await db.expenses.delete_many({"user_id": user_id, "id": {"$in": [doc['id'] for doc in batch]}})
+    await db[MANIFEST_COLLECTION].update_one(
+        {"_id": _manifest_id(user_id, month), "parts.id": part_id}, {"$set": {"parts.$.done": True}}
+    )
+
+
+async def _archive_month(db, user_id, month, sink):
+    await _finish_parts(db, user_id, month)
+    start, end = _month_bounds(month)
+    query = {"user_id": user_id, "date": {"$gte": start, "$lt": end}}
+    count = 0
+    batch = []
+    async for doc in db.expenses.find(query, {"_id": 0}).batch_size(BATCH_SIZE):
+        batch.append(doc)
+        if len(batch) >= BATCH_SIZE:
+            await _archive_batch(db, user_id, month, sink, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        await _archive_batch(db, user_id, month, sink, batch)
+        count += len(batch)
+    return count
+
+
+async def archive_expenses(db, horizon_days, target="collection", archive_dir="archive"):
+    # Only whole months that ended before the horizon are moved
+    cutoff = (datetime.utcnow().date() - timedelta(days=horizon_days)).replace(day=1).isoformat()
+    pipeline = [
+        {"$match": {"date": {"$lt": cutoff}}},
+        {"$group": {"_id": {"user_id": "$user_id", "month": {"$substrBytes": ["$date", 0, 7]}}}}
+    ]
+    archived = 0
+    async for row in db.expenses.aggregate(pipeline):
+        user_id, month = row['_id']['user_id'], row['_id']['month']
+        if target == "files":
+            sink = _FileSink(archive_dir, user_id, month)
+        else:
+            sink = _CollectionSink(db)
+        archived += await _archive_month(db, user_id, month, sink)
+    return archived
+
+
+async def archived_buckets(db):
+    # Per (user, day, category) totals of everything moved out of expenses
+    buckets = {}
+    async for doc in db[MANIFEST_COLLECTION].find({}, {"user_id": 1, "buckets": 1}):
+        for key, value in doc.get('buckets', {}).items():
+            day, category = key.split("|", 1)
+            buckets[(doc['user_id'], day, category)] = (value['total'], value['count'])
+    return buckets
+
+
+async def list_months(db, user_id):
+    cursor = db[MANIFEST_COLLECTION].find(
+        {"user_id": user_id}, {"_id": 0, "month": 1, "count": 1, "total": 1}
+    ).sort("month", ASCENDING)
+    return await cursor.to_list(None)
+
+
+def _read_file_lines(path):
+    with gzip.open(path, "rb") as f:
+        for line in f:
+            yield line
+
+
+async def iter_month(db, user_id, month):
+    manifest = await db[MANIFEST_COLLECTION].find_one({"_id": _manifest_id(user_id, month)})
+    if not manifest:
+        return
+    start, end = _month_bounds(month)
+    read_collection = False
+    for part in manifest.get('parts', []):
+        if part['type'] == "file":
+            lines = _read_file_lines(part['path'])
+            # gzip reads block, so pull lines off the event loop in chunks
+            while True:
+                chunk = await asyncio.to_thread(lambda: [line for _, line in zip(range(1000), lines)])
+                if not chunk:
+                    break
+                yield b"".join(chunk)
+        elif not read_collection:
+            read_collection = True
+            cursor = db[ARCHIVE_COLLECTION].find(
+                {"user_id": user_id, "date": {"$gte": start, "$lt": end}}, {"_id": 0, "archive_part": 0}
+            ).batch_size(1000)
+            async for doc in cursor:
+                yield orjson.dumps(doc) + b"\n"
+
+
+async def iter_archived(db, projection=None):
+    # Every archived row, wherever it went; used by the reporting snapshot
+    async for doc in db[ARCHIVE_COLLECTION].find({}, {"_id": 0, **(projection or {"archive_part": 0})}).batch_size(BATCH_SIZE):
+        yield doc
+    async for manifest in db[MANIFEST_COLLECTION].find({"parts.type": "file"}, {"parts": 1}):
+        for part in manifest['parts']:
+            if part['type'] != "file":
+                continue
+            lines = _read_file_lines(part['path'])
+            while True:
+                chunk = await asyncio.to_thread(lambda: [line for _, line in zip(range(BATCH_SIZE), lines)])
+                if not chunk:
+                    break
+                for line in chunk:
+                    yield orjson.loads(line)
+
+
+async def _main(horizon_days, target):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        db = client[os.environ['DB_NAME']]
+        await ensure_indexes(db)
+        count = await archive_expenses(
+            db, horizon_days, target=target, archive_dir=os.environ.get('ARCHIVE_DIR', 'archive')
+        )
+        print("Archived {} expenses older than {} days to {}".format(count, horizon_days, target))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    horizon = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.environ.get('ARCHIVE_HORIZON_DAYS', '365'))
+    target = sys.argv[2] if len(sys.argv) > 2 else os.environ.get('ARCHIVE_TARGET', 'collection')
+    if target not in ("collection", "files"):
+        print("usage: python archive.py [horizon_days] [collection|files]")
+        sys.exit(2)
+    asyncio.run(_main(horizon, target))
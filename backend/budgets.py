@@ -0,0 +1,108 @@
+"""Monthly budgets, overall and per category, with alerts on overspend.
+
+A budget is one document per user. Spending is not summed here: every
+expense write already goes through ``rollups.apply_expense``, whose
+``find_one_and_update`` on the month totals document returns the month's
+running totals after the write. Comparing those with the budget costs no
+extra query. Budgets themselves are read through a short per-process cache,
+so the write path only touches the database again when an alert is raised.
+
+An alert is stored the first time a month's spending crosses a limit, keyed
+by user, month and scope so every crossing is recorded once.
+"""
+import time
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+BUDGET_COLLECTION = "budgets"
+ALERT_COLLECTION = "budget_alerts"
+OVERALL = "overall"
+DUPLICATE_KEY = 11000
+
+
+async def ensure_indexes(db):
+    await db[ALERT_COLLECTION].create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+
+
+class BudgetCache:
+    def __init__(self, ttl=30, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+
+    async def get(self, db, user_id):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        budget = await db[BUDGET_COLLECTION].find_one({"_id": user_id}, {"_id": 0})
+        if len(self._entries) >= self.max_entries:
+            self._entries.clear()
+        self._entries[user_id] = (time.monotonic() + self.ttl, budget)
+        return budget
+
+    def invalidate(self, user_id):
+        self._entries.pop(user_id, None)
+
+
+def limits(budget):
+    # scope -> limit; the overall scope is keyed OVERALL, categories by name
+    if not budget:
+        return {}
+    scopes = dict(budget.get('categories') or {})
+    if budget.get('overall') is not None:
+        scopes[OVERALL] = budget['overall']
+    return scopes
+
+
+def evaluate(budget, month_totals, expense=None):
+    """Scopes over their limit in month_totals; ``crossed`` marks the ones this expense pushed over."""
+    alerts = []
+    if not budget or not month_totals:
+        return alerts
+    category = getattr(expense['category'], "value", expense['category']) if expense else None
+    for scope, limit in limits(budget).items():
+        if scope == OVERALL:
+            spent = month_totals.get('total', 0.0)
+        else:
+            spent = (month_totals.get('categories') or {}).get(scope, 0.0)
+        if spent <= limit:
+            continue
+        crossed = expense is not None and scope in (OVERALL, category) and spent - expense['amount'] <= limit
+        alerts.append({
+            "month": month_totals['month'],
+            "scope": scope,
+            "limit": limit,
+            "spent": spent,
+            "crossed": crossed
+        })
+    return alerts
+
+
+async def record_alerts(db, user_id, alerts):
+    crossed = [alert for alert in alerts if alert['crossed']]
+    if not crossed:
+        return
+    docs = [{
+        "_id": "{}|{}|{}".format(user_id, alert['month'], alert['scope']),
+        "user_id": user_id,
+        "month": alert['month'],
+        "scope": alert['scope'],
+        "limit": alert['limit'],
+        "spent": alert['spent'],
+        "created_at": datetime.utcnow()
+    } for alert in crossed]
+    try:
+        await db[ALERT_COLLECTION].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Spending that dipped back under and crossed again keeps the first alert
+        if any(error['code'] != DUPLICATE_KEY for error in e.details['writeErrors']):
+            raise
+
+
+async def list_alerts(db, user_id, month=None):
+    query = {"user_id": user_id}
+    if month:
+        query["month"] = month
+    return await db[ALERT_COLLECTION].find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
@@ -0,0 +1,171 @@
+"""Response cache for read-heavy routes.
+
+Entries are keyed by route, query string and the current generation of every
+data namespace the route depends on. Write routes bump a namespace's
+generation, which makes every older entry unreachable without having to find
+and delete it. Bodies are stored already encoded along with their ETag so
+hits and 304s never touch the database or the JSON encoder.
+
+With several worker processes the generation counters must be shared, or a
+write served by one worker would leave stale entries in the others. Redis
+shares both entries and counters; the in-process LRU can be paired with
+``MongoCounters`` so each worker keeps its own entries but all of them agree
+on generations.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import orjson
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+from prometheus_client import Counter
+from pymongo import ReturnDocument
+
+CACHE_LOOKUPS = Counter(
+    "smartspend_cache_lookups_total",
+    "Response cache lookups by route and result",
+    ["route", "result"]
+)
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, max_entries=256, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._counters = {}
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def counters(self, keys):
+        return {key: self._counters.get(key, 0) for key in keys}
+
+    async def incr(self, key):
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+
+class RedisBackend:
+    name = "redis"
+
+    def __init__(self, url, ttl=60, prefix="smartspend:cache:"):
+        import redis.asyncio as redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    async def get(self, key):
+        return await self._redis.get(self.prefix + key)
+
+    async def set(self, key, value):
+        await self._redis.set(self.prefix + key, value, ex=self.ttl)
+
+    async def counters(self, keys):
+        values = await self._redis.mget([self.prefix + "gen:" + key for key in keys])
+        return {key: int(value) if value else 0 for key, value in zip(keys, values)}
+
+    async def incr(self, key):
+        return await self._redis.incr(self.prefix + "gen:" + key)
+
+
+class MongoCounters:
+    def __init__(self, get_db, collection="cache_generations"):
+        self.get_db = get_db
+        self.collection = collection
+
+    async def counters(self, keys):
+        docs = await self.get_db()[self.collection].find({"_id": {"$in": list(keys)}}).to_list(None)
+        values = {doc['_id']: doc['value'] for doc in docs}
+        return {key: values.get(key, 0) for key in keys}
+
+    async def incr(self, key):
+        doc = await self.get_db()[self.collection].find_one_and_update(
+            {"_id": key}, {"$inc": {"value": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc['value']
+
+
+class ResponseCache:
+    def __init__(self, backend, counters=None):
+        self.backend = backend
+        self.counters = counters or backend
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    async def bump(self, *namespaces):
+        # Returns the new generation of each namespace
+        return {namespace: await self.counters.incr(namespace) for namespace in namespaces}
+
+    async def _key(self, route, namespaces, params, extra):
+        current = await self.counters.counters(namespaces)
+        generations = [str(current[namespace]) for namespace in namespaces]
+        query = "&".join(sorted("{}={}".format(k, v) for k, v in params.items()))
+        return "|".join([route, ".".join(generations), query] + [str(part) for part in extra])
+
+    def _response(self, request, etag, body):
+        if request.headers.get("if-none-match") == etag:
+            self.not_modified += 1
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+    async def body(self, route, namespaces, compute, params=None, extra=()):
+        """(etag, JSON body) for a route, computed only when a namespace changed."""
+        key = await self._key(route, namespaces, params or {}, extra)
+        cached = await self.backend.get(key)
+        if cached is not None:
+            self.hits += 1
+            CACHE_LOOKUPS.labels(route, "hit").inc()
+            etag, body = cached.split(b"\n", 1)
+            return etag.decode(), body
+
+        self.misses += 1
+        CACHE_LOOKUPS.labels(route, "miss").inc()
+        # orjson handles dicts, lists and datetimes natively; models fall back to the encoder
+        body = orjson.dumps(await compute(), default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        await self.backend.set(key, etag.encode() + b"\n" + body)
+        return etag, body
+
+    async def respond(self, request, route, namespaces, compute, extra=()):
+        etag, body = await self.body(route, namespaces, compute, request.query_params, extra)
+        return self._response(request, etag, body)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        # Counts are for this worker; the Prometheus counters aggregate across workers
+        return {
+            "backend": self.backend.name,
+            "shared_generations": self.counters is not self.backend or self.backend.name == "redis",
+            "worker_pid": os.getpid(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+def create_cache(backend="memory", redis_url=None, ttl=60, max_entries=256, counters=None):
+    if backend == "redis":
+        return ResponseCache(RedisBackend(redis_url, ttl=ttl))
+    return ResponseCache(MemoryBackend(max_entries=max_entries, ttl=ttl), counters=counters)
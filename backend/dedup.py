@@ -0,0 +1,188 @@
+"""Duplicate detection for expenses.
+
+Every new expense carries ``dedup_key``, a fingerprint of its amount, date
+and normalized description, and a unique partial index on (user_id,
+dedup_key) rejects exact repeats such as a re-imported statement or a
+double-tapped add button. Writers that mean to store a repeat set the key to
+null, which the index skips. Expenses written before fingerprinting have no
+key at all.
+
+Near duplicates (same amount within a few days, any description) are only
+reported, using the (user_id, amount, date) index. The batch scan walks all
+expenses in (user_id, amount, date) order and cuts a cluster wherever the
+amount changes or the gap between dates exceeds the window, so it is one
+sorted pass instead of comparing every pair.
+
+    python dedup.py scan [user_id]    # report clusters
+    python dedup.py merge [user_id]   # drop exact repeats, fingerprint old rows
+"""
+import asyncio
+import hashlib
+import os
+import re
+import sys
+from datetime import date, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import rollups
+
+# Same amount within this many days counts as a possible duplicate
+NEAR_DAYS = 2
+MAX_NEAR_MATCHES = 5
+BATCH_SIZE = 5000
+DUPLICATE_KEY = 11000
+SCAN_ORDER = [("user_id", ASCENDING), ("amount", ASCENDING), ("date", ASCENDING)]
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(description):
+    return " ".join(_WORD.findall(description.lower()))
+
+
+def fingerprint(expense):
+    payload = "{:.2f}|{}|{}".format(expense['amount'], expense['date'], normalize(expense['description']))
+    return hashlib.blake2b(payload.encode(), digest_size=12).hexdigest()
+
+
+async def ensure_indexes(db):
+    # Starts with user_id, the expenses shard key, as sharding requires of unique indexes
+    await db.expenses.create_index(
+        [("user_id", ASCENDING), ("dedup_key", ASCENDING)],
+        unique=True, partialFilterExpression={"dedup_key": {"$type": "string"}}
+    )
+    # Equality on amount before the date range, so the window check is one tight index scan
+    await db.expenses.create_index(SCAN_ORDER)
+
+
+async def near_duplicates(db, expense, days=NEAR_DAYS):
+    day = date.fromisoformat(expense['date'])
+    query = {
+        "user_id": expense['user_id'],
+        "amount": expense['amount'],
+        "date": {"$gte": (day - timedelta(days=days)).isoformat(), "$lte": (day + timedelta(days=days)).isoformat()},
+        "id": {"$ne": expense['id']}
+    }
+    docs = await db.expenses.find(query, {"_id": 0, "id": 1}).limit(MAX_NEAR_MATCHES).to_list(MAX_NEAR_MATCHES)
+    return [doc['id'] for doc in docs]
+
+
+def _cluster(run):
+    # Exact groups exclude rows whose key was deliberately cleared; oldest row first
+    groups = {}
+    for doc in run:
+        if doc.get('dedup_key', "") is not None:
+            groups.setdefault(fingerprint(doc), []).append(doc)
+    exact = [
+        [doc['id'] for doc in sorted(group, key=lambda d: d['created_at'])]
+        for group in groups.values() if len(group) > 1
+    ]
+    return {
+        "user_id": run[0]['user_id'],
+        "amount": run[0]['amount'],
+        "expenses": [{key: doc[key] for key in ("id", "date", "category", "description")} for doc in run],
+        "exact": exact
+    }
+
+
+async def iter_clusters(db, user_id=None, days=NEAR_DAYS):
+    query = {"user_id": user_id} if user_id else {}
+    projection = {"_id": 0, "id": 1, "user_id": 1, "amount": 1, "date": 1, "category": 1,
+                  "description": 1, "created_at": 1, "dedup_key": 1}
+    run = []
+    last_day = None
+    async for doc in db.expenses.find(query, projection).sort(SCAN_ORDER).batch_size(BATCH_SIZE):
+        day = date.fromisoformat(doc['date'])
+        if run and (doc['user_id'] != run[0]['user_id'] or doc['amount'] != run[0]['amount']
+                    or (day - last_day).days > days):
+            if len(run) > 1:
+                yield _cluster(run)
+            run = []
+        run.append(doc)
+        last_day = day
+    if len(run) > 1:
+        yield _cluster(run)
+
+
+async def merge_exact(db, user_id=None):
+    """Delete all but the oldest row of every exact group; returns the rows removed."""
+    removed = {}
+    async for cluster in iter_clusters(db, user_id):
+        for ids in cluster['exact']:
+            removed.setdefault(cluster['user_id'], []).extend(ids[1:])
+
+    deleted = []
+    for owner, ids in removed.items():
+        for start in range(0, len(ids), BATCH_SIZE):
+            query = {"user_id": owner, "id": {"$in": ids[start:start + BATCH_SIZE]}}
+            docs = await db.expenses.find(query, {"_id": 0}).to_list(None)
+            await db.expenses.delete_many(query)
+            await rollups.apply_expenses(db, docs, sign=-1)
+            deleted.extend(docs)
+    return deleted
+
+
+async def backfill_keys(db, user_id=None):
+    # Fingerprint rows written before dedup_key existed; run after merge_exact
+    query = {"dedup_key": {"$exists": False}}
+    if user_id:
+        query["user_id"] = user_id
+    projection = {"_id": 1, "amount": 1, "date": 1, "description": 1}
+    updated = 0
+    ops = []
+
+    async def flush(ops):
+        try:
+            result = await db.expenses.bulk_write(ops, ordered=False)
+            return result.modified_count
+        except BulkWriteError as e:
+            # A repeat written meanwhile keeps no key rather than failing the run
+            if any(error['code'] != DUPLICATE_KEY for error in e.details['writeErrors']):
+                raise
+            return e.details['nModified']
+
+    async for doc in db.expenses.find(query, projection).batch_size(BATCH_SIZE):
+        ops.append(UpdateOne({"_id": doc['_id']}, {"$set": {"dedup_key": fingerprint(doc)}}))
+        if len(ops) >= BATCH_SIZE:
+            updated += await flush(ops)
+            ops = []
+    if ops:
+        updated += await flush(ops)
+    return updated
+
+
+async def _main(command, user_id):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        db = client[os.environ['DB_NAME']]
+        if command == "scan":
+            clusters = exact = 0
+            async for cluster in iter_clusters(db, user_id):
+                clusters += 1
+                exact += sum(len(ids) - 1 for ids in cluster['exact'])
+                print("{user_id} {amount:.2f}: {count} rows on {days}".format(
+                    count=len(cluster['expenses']),
+                    days=", ".join(sorted({e['date'] for e in cluster['expenses']})),
+                    **cluster
+                ))
+            print("{} clusters, {} exact repeats".format(clusters, exact))
+        else:
+            deleted = await merge_exact(db, user_id)
+            await ensure_indexes(db)
+            updated = await backfill_keys(db, user_id)
+            print("Removed {} exact repeats, fingerprinted {} expenses".format(len(deleted), updated))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if not sys.argv[1:] or sys.argv[1] not in ("scan", "merge"):
+        print("usage: python dedup.py scan|merge [user_id]")
+        sys.exit(2)
+    asyncio.run(_main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None))
@@ -0,0 +1,196 @@
+"""Live change events for open dashboards, delivered over SSE.
+
+Events are small deltas: the expense that was created, updated or deleted,
+the change to one (day, category) total, or a goal's new progress. A
+``resync`` event tells a client to refetch instead, e.g. after a bulk import
+or when it fell too far behind to be sent every delta.
+
+On a replica set or sharded cluster every worker watches a MongoDB change
+stream, so subscribers see writes made by any worker or host. A standalone
+server has no change streams; the write routes then publish into the bus
+themselves, which reaches subscribers of the same process only.
+
+Deletes are the exception: without a pre-image a delete's change event may
+not say whose expense it was. The delete route knows, so it publishes the
+delete itself in either mode, and the watcher skips the events for deletes
+this process already published and ignores the ones it cannot attribute.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+
+from prometheus_client import Gauge
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Events buffered per subscriber before it is told to resync instead
+QUEUE_SIZE = 256
+# Expense ids deleted by this process whose change events have not come round yet
+PUBLISHED_DELETES = 1024
+WATCHED_COLLECTIONS = ("expenses", "savings_goals")
+RESYNC = {"type": "resync"}
+# The resume token fell off the oplog; the stream has to restart from now
+CHANGE_STREAM_HISTORY_LOST = 286
+
+SUBSCRIBERS = Gauge(
+    "smartspend_event_subscribers",
+    "Open live event streams",
+    multiprocess_mode="livesum"
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Storage-only fields that never go out to clients
+_PRIVATE = ("_id", "dedup_key")
+
+
+def _public(doc):
+    return {key: value for key, value in doc.items() if key not in _PRIVATE}
+
+
+def expense_events(before, after):
+    # before is None for a new expense, after is None for a deleted one
+    if after is None:
+        events = [{"type": "expense_deleted", "id": before['id']}]
+    elif before is None:
+        events = [{"type": "expense_created", "expense": _public(after)}]
+    else:
+        events = [{"type": "expense_updated", "expense": _public(after)}]
+
+    deltas = {}
+    for doc, sign in ((before, -1), (after, 1)):
+        if doc is not None:
+            key = (doc['date'], doc['category'])
+            amount, count = deltas.get(key, (0.0, 0))
+            deltas[key] = (amount + sign * doc['amount'], count + sign)
+    for (day, category), (amount, count) in deltas.items():
+        if amount or count:
+            events.append({"type": "category_delta", "day": day, "category": category,
+                           "amount": amount, "count": count})
+    return events
+
+
+def goal_event(goal):
+    return {"type": "goal_progress", "goal": _public(goal)}
+
+
+class EventBus:
+    def __init__(self, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.source = "local"
+        self._subscribers = {}
+        self._published_deletes = OrderedDict()
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        SUBSCRIBERS.inc()
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self._subscribers.get(user_id)
+        if queues and queue in queues:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+            SUBSCRIBERS.dec()
+
+    def publish(self, user_id, events):
+        for queue in self._subscribers.get(user_id, ()):
+            for event in events:
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # A slow client gets one resync in place of its backlog
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(RESYNC)
+                    break
+
+    def publish_local(self, user_id, events):
+        # Write routes call this; with a change stream the watcher publishes instead
+        if self.source == "local":
+            self.publish(user_id, events)
+
+    def publish_delete(self, user_id, expense):
+        # The route publishes in both modes; the watcher then skips this delete's own event
+        self.publish(user_id, expense_events(expense, None))
+        if self.source == "changestream":
+            self._published_deletes[expense['id']] = None
+            while len(self._published_deletes) > PUBLISHED_DELETES:
+                self._published_deletes.popitem(last=False)
+
+    async def start(self, db, source="auto"):
+        if source == "auto":
+            hello = await db.client.admin.command("hello")
+            source = "changestream" if "setName" in hello or hello.get("msg") == "isdbgrid" else "local"
+        self.source = source
+        if source == "changestream":
+            return asyncio.create_task(self.watch(db))
+        return None
+
+    def _dispatch(self, change):
+        collection = change['ns']['coll']
+        operation = change['operationType']
+        before = change.get('fullDocumentBeforeChange')
+        after = change.get('fullDocument') if operation != "delete" else None
+        # documentKey carries user_id only where it is the shard key; a delete with
+        # neither is ignored, as the route that deleted it has published it already
+        owner = after or before or change.get('documentKey', {})
+        user_id = owner.get('user_id')
+        if user_id is None or user_id not in self._subscribers:
+            return
+        if operation == "delete" and collection == "expenses" and before is not None \
+                and before['id'] in self._published_deletes:
+            del self._published_deletes[before['id']]
+            return
+
+        if collection == "savings_goals":
+            if after is not None:
+                self.publish(user_id, [goal_event(after)])
+        elif operation == "insert":
+            self.publish(user_id, expense_events(None, after))
+        elif before is None or (after is None and operation != "delete"):
+            # No pre-image (or the document is already gone), so no exact delta
+            self.publish(user_id, [RESYNC])
+        else:
+            self.publish(user_id, expense_events(before, after))
+
+    async def watch(self, db):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(WATCHED_COLLECTIONS)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]}
+        }}]
+        try:
+            # Pre-images give update/delete events their old amount (MongoDB 6.0+)
+            await db.command("collMod", "expenses", changeStreamPreAndPostImages={"enabled": True})
+        except OperationFailure as e:
+            logger.warning("Expense pre-images unavailable, updates will resync clients: %s", e)
+
+        resume_token = None
+        while True:
+            try:
+                async with db.watch(
+                    pipeline, full_document="updateLookup",
+                    full_document_before_change="whenAvailable", resume_after=resume_token
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        self._dispatch(change)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as e:
+                logger.exception("Change stream interrupted, resuming")
+                if getattr(e, "code", None) == CHANGE_STREAM_HISTORY_LOST:
+                    resume_token = None
+                # Clients may have missed changes while the stream was down
+                for user_id in list(self._subscribers):
+                    self.publish(user_id, [RESYNC])
+                await asyncio.sleep(1)
+
+    def stats(self):
+        return {
+            "source": self.source,
+            "users": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values())
+        }
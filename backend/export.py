@@ -0,0 +1,217 @@
+"""Streaming expense export as CSV, JSONL or XLSX.
+
+Each encoder is an async generator that takes documents straight off a Motor
+cursor and yields encoded chunks of ROWS_PER_CHUNK rows, so memory is bounded
+by one cursor batch plus one chunk whatever the export size.
+
+XLSX is a zip of XML parts. ``zipfile`` writes to an unseekable stream by
+putting sizes and CRCs in data descriptors after each member, so the sheet is
+compressed row by row into a sink that is drained after every chunk. The
+workbook parts that list the sheets go last, once the sheet count is known;
+rows beyond the sheet limit continue on a new sheet.
+"""
+import csv
+import io
+import re
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+
+import orjson
+
+COLUMNS = ("id", "date", "category", "description", "amount", "created_at", "recurring_id")
+ROWS_PER_CHUNK = 1000
+# Excel's row limit, less the header row
+SHEET_ROWS = 1048576 - 1
+
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+}
+
+# Characters XML 1.0 does not allow at all, even escaped
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _value(doc, column):
+    value = doc.get(column)
+    if column == "created_at" and value is not None:
+        return value.isoformat()
+    return value
+
+
+async def csv_chunks(docs):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    rows = 0
+    async for doc in docs:
+        writer.writerow([_value(doc, column) for column in COLUMNS])
+        rows += 1
+        if rows % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+async def jsonl_chunks(docs):
+    lines = []
+    async for doc in docs:
+        lines.append(orjson.dumps({column: doc.get(column) for column in COLUMNS}))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
+
+
+class _Sink:
+    """Write-only file object for zipfile; chunks are taken out as they are written."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _cell(value):
+    # Cell and row references are optional; cells are placed in order, so gaps are written as <c/>
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return "<c><v>{}</v></c>".format(value)
+    return '<c t="inlineStr"><is><t>{}</t></is></c>'.format(escape(_XML_ILLEGAL.sub("", str(value))))
+
+
+def _row(values):
+    return "<row>{}</row>".format("".join(map(_cell, values)))
+
+
+SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_END = '</sheetData></worksheet>'
+
+
+def _workbook_parts(sheets):
+    numbers = range(1, sheets + 1)
+    content_types = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        + "".join(
+            '<Override PartName="/xl/worksheets/sheet{}.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'.format(n)
+            for n in numbers
+        ) + '</Types>'
+    )
+    root_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'
+    )
+    workbook = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+        + "".join('<sheet name="Expenses{}" sheetId="{}" r:id="rId{}"/>'.format(
+            " {}".format(n) if n > 1 else "", n, n) for n in numbers)
+        + '</sheets></workbook>'
+    )
+    workbook_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        + "".join(
+            '<Relationship Id="rId{0}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+            'Target="worksheets/sheet{0}.xml"/>'.format(n)
+            for n in numbers
+        ) + '</Relationships>'
+    )
+    return [
+        ("[Content_Types].xml", content_types),
+        ("_rels/.rels", root_rels),
+        ("xl/workbook.xml", workbook),
+        ("xl/_rels/workbook.xml.rels", workbook_rels)
+    ]
+
+
+async def xlsx_chunks(docs):
+    sink = _Sink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED)
+    sheets = 0
+    sheet = None
+    rows = SHEET_ROWS
+    pending = []
+
+    def open_sheet():
+        nonlocal sheet, sheets, rows
+        if sheet:
+            sheet.write(SHEET_END.encode())
+            sheet.close()
+        sheets += 1
+        # force_zip64 because the member size is not known before it is written
+        sheet = archive.open("xl/worksheets/sheet{}.xml".format(sheets), "w", force_zip64=True)
+        sheet.write((SHEET_START + _row(COLUMNS)).encode())
+        rows = 0
+
+    async for doc in docs:
+        if rows >= SHEET_ROWS:
+            if pending:
+                sheet.write("".join(pending).encode())
+                pending = []
+            open_sheet()
+        rows += 1
+        pending.append(_row([_value(doc, column) for column in COLUMNS]))
+        if len(pending) >= ROWS_PER_CHUNK:
+            sheet.write("".join(pending).encode())
+            pending = []
+            data = sink.drain()
+            if data:
+                yield data
+    if sheet is None:
+        open_sheet()
+    if pending:
+        sheet.write("".join(pending).encode())
+    sheet.write(SHEET_END.encode())
+    sheet.close()
+    for name, content in _workbook_parts(sheets):
+        archive.writestr(name, content)
+    archive.close()
+    yield sink.drain()
+
+
+ENCODERS = {"csv": csv_chunks, "jsonl": jsonl_chunks, "xlsx": xlsx_chunks}
+
+
+async def gzipped(chunks):
+    # wbits=31 writes a gzip header and trailer around the deflate stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def encode(docs, kind, gzip=False):
+    chunks = ENCODERS[kind](docs)
+    return gzipped(chunks) if gzip else chunks
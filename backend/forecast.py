@@ -0,0 +1,128 @@
+"""End-of-month spend forecasts computed from the daily rollups.
+
+Each (user, category) series is projected as a blend of an exponentially
+weighted daily rate and a weighted day-of-week profile, with every user's
+series computed at once as NumPy matrix operations. Results are stored per
+user and month so the dashboard reads a single precomputed document. Run
+``python forecast.py`` to refresh them by hand; the app also refreshes them
+periodically.
+"""
+import asyncio
+import os
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne
+
+import rollups
+
+FORECAST_COLLECTION = "spend_forecasts"
+HISTORY_DAYS = 90
+HALF_LIFE_DAYS = 14.0
+# Share of the projection taken from the weekday profile rather than the flat rate
+SEASONAL_WEIGHT = 0.5
+SERIES_FIELDS = ("user_id", "category")
+
+
+def _month_end(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def _forecast_id(user_id, month):
+    return "{}|{}".format(user_id, month)
+
+
+async def load_daily_series(db, start, end):
+    days = np.arange(np.datetime64(start.isoformat()), np.datetime64(end.isoformat()) + 1)
+    keys = {}
+    rows, cols, totals = [], [], []
+    query = {"day": {"$gte": start.isoformat(), "$lte": end.isoformat()}, "count": {"$gt": 0}}
+    projection = {"_id": 0, "day": 1, "total": 1, **{field: 1 for field in SERIES_FIELDS}}
+    async for doc in db[rollups.ROLLUP_COLLECTION].find(query, projection):
+        key = tuple(doc[field] for field in SERIES_FIELDS)
+        rows.append(keys.setdefault(key, len(keys)))
+        cols.append((date.fromisoformat(doc['day']) - start).days)
+        totals.append(doc['total'])
+
+    matrix = np.zeros((len(keys), len(days)))
+    np.add.at(matrix, (np.array(rows, dtype=int), np.array(cols, dtype=int)), np.array(totals))
+    return list(keys), days, matrix
+
+
+def project(days, matrix, today):
+    month_start = np.datetime64(today.replace(day=1).isoformat())
+    today64 = np.datetime64(today.isoformat())
+    month_to_date = matrix[:, days >= month_start].sum(axis=1)
+
+    # Exponential decay weights: yesterday counts most, HALF_LIFE_DAYS ago half as much
+    age = (today64 - days).astype(int)
+    weights = 0.5 ** (age / HALF_LIFE_DAYS)
+    rate = matrix @ weights / weights.sum()
+
+    # Weighted mean spend for each weekday (Monday=0), shape (series, 7)
+    weekday = (days.astype("datetime64[D]").view("int64") - 4) % 7
+    onehot = np.eye(7)[weekday] * weights[:, None]
+    weekday_weight = onehot.sum(axis=0)
+    weekday_rate = np.divide(
+        matrix @ onehot, weekday_weight,
+        out=np.tile(rate[:, None], (1, 7)), where=weekday_weight > 0
+    )
+
+    # Project from tomorrow to the end of the month; today is counted as spent
+    remaining = np.arange(today64 + 1, np.datetime64(_month_end(today).isoformat()) + 1)
+    remaining_weekdays = np.bincount((remaining.view("int64") - 4) % 7, minlength=7)
+    flat = rate * len(remaining)
+    seasonal = weekday_rate @ remaining_weekdays
+    projected_remaining = (1 - SEASONAL_WEIGHT) * flat + SEASONAL_WEIGHT * seasonal
+    return month_to_date, month_to_date + projected_remaining
+
+
+async def refresh_forecasts(db, today=None):
+    today = today or datetime.utcnow().date()
+    start = today - timedelta(days=HISTORY_DAYS)
+    keys, days, matrix = await load_daily_series(db, start, today)
+    month_to_date, projected = project(days, matrix, today)
+
+    month = today.strftime("%Y-%m")
+    generated_at = datetime.utcnow()
+    docs = {}
+    for (user_id, category), mtd, total in zip(keys, month_to_date, projected):
+        doc = docs.setdefault(user_id, {
+            "user_id": user_id,
+            "month": month,
+            "generated_at": generated_at,
+            "as_of": today.isoformat(),
+            "month_to_date": 0.0,
+            "projected_total": 0.0,
+            "categories": {}
+        })
+        doc["month_to_date"] += float(mtd)
+        doc["projected_total"] += float(total)
+        doc["categories"][category] = {"month_to_date": float(mtd), "projected_total": float(total)}
+
+    ops = [ReplaceOne({"_id": _forecast_id(user_id, month)}, doc, upsert=True) for user_id, doc in docs.items()]
+    if ops:
+        await db[FORECAST_COLLECTION].bulk_write(ops, ordered=False)
+    return docs
+
+
+async def get_forecast(db, user_id, today=None):
+    today = today or datetime.utcnow().date()
+    return await db[FORECAST_COLLECTION].find_one({"_id": _forecast_id(user_id, today.strftime("%Y-%m"))}, {"_id": 0})
+
+
+async def _main():
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        docs = await refresh_forecasts(client[os.environ['DB_NAME']])
+        print("Refreshed forecasts for {} users".format(len(docs)))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,21 @@
+import os
+
+from prometheus_client import multiprocess
+
+bind = "0.0.0.0:8001"
+# Same default as server.py's WEB_CONCURRENCY
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = 30
+
+
+def on_starting(server):
+    # The app switches to shared cache generations when WEB_CONCURRENCY > 1, so it must
+    # see the worker count actually used, including a --workers given on the command line
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges from the merged /metrics output
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,75 @@
+"""Row readers for bank statement uploads.
+
+Each reader yields plain dicts shaped like ``ExpenseCreate`` one row at a
+time, so an upload is validated and inserted while it is still being read.
+Rows that are not expenses, such as statement credits, are yielded as None so
+row numbers still match the file.
+"""
+import csv
+import io
+import re
+from datetime import datetime
+
+OFX_TRANSACTION = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.IGNORECASE | re.DOTALL)
+OFX_FIELD = re.compile(r"<(\w+)>([^<\r\n]*)")
+# Year-first dates with any separator and unpadded parts, e.g. 2024-1-5 or 2024/01/05
+YEAR_FIRST_DATE = re.compile(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})")
+# Transaction types for money coming in; skipped whatever sign the bank gave the amount
+OFX_CREDIT_TYPES = {"CREDIT", "DEP", "DIRECTDEP", "INT", "DIV"}
+
+
+def _csv_date(value):
+    # Only year-first dates are unambiguous; 01/02/2024 is left as is and fails validation as a row error
+    match = YEAR_FIRST_DATE.fullmatch(value)
+    if not match:
+        return value
+    year, month, day = map(int, match.groups())
+    return "{:04d}-{:02d}-{:02d}".format(year, month, day)
+
+
+def read_csv(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    for row in csv.DictReader(text):
+        # Blank cells are dropped so model defaults (such as today's date) apply
+        row = {key.strip().lower(): value.strip() for key, value in row.items() if key and value and value.strip()}
+        if "date" in row:
+            row["date"] = _csv_date(row["date"])
+        yield row
+
+
+def _ofx_date(value):
+    # DTPOSTED looks like 20240131120000.000[-5:EST]; only the day matters here
+    return datetime.strptime(value[:8], "%Y%m%d").date().isoformat()
+
+
+def read_ofx(fileobj, default_category="Other"):
+    # SGML-style OFX has no closing tags on leaf fields, so scan transaction blocks
+    content = fileobj.read().decode("utf-8", errors="replace")
+    for block in OFX_TRANSACTION.finditer(content):
+        fields = {key.upper(): value.strip() for key, value in OFX_FIELD.findall(block.group(1))}
+        row = {
+            "amount": fields.get("TRNAMT", ""),
+            "category": default_category,
+            "description": fields.get("NAME") or fields.get("MEMO", ""),
+        }
+        try:
+            amount = float(row["amount"])
+        except ValueError:
+            amount = None
+        if fields.get("TRNTYPE", "").upper() in OFX_CREDIT_TYPES or (amount is not None and amount >= 0):
+            yield None
+            continue
+        if amount is not None:
+            # Debits are negative in the statement and stored as positive spend
+            row["amount"] = -amount
+        try:
+            row["date"] = _ofx_date(fields.get("DTPOSTED", ""))
+        except ValueError:
+            pass
+        yield row
+
+
+def read_rows(filename, fileobj):
+    if filename.lower().endswith((".ofx", ".qfx")):
+        return read_ofx(fileobj)
+    return read_csv(fileobj)
@@ -0,0 +1,56 @@
+"""Lease locks in MongoDB so only one worker runs a periodic job at a time."""
+import asyncio
+import os
+import socket
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+LOCK_COLLECTION = "job_locks"
+
+# Identifies this worker process across hosts
+OWNER = "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+async def acquire(db, name, ttl_seconds):
+    # Take the lease if it is free, expired or already ours; renewing extends it
+    now = datetime.utcnow()
+    try:
+        doc = await db[LOCK_COLLECTION].find_one_and_update(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": OWNER}]},
+            {"$set": {"owner": OWNER, "expires_at": now + timedelta(seconds=ttl_seconds)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another worker holds an unexpired lease, so the upsert collided with it
+        return False
+    return doc is not None and doc['owner'] == OWNER
+
+
+async def release(db, name):
+    await db[LOCK_COLLECTION].delete_one({"_id": name, "owner": OWNER})
+
+
+@asynccontextmanager
+async def held(db, name, ttl_seconds):
+    """For one-off jobs: yields whether the lease was taken, renews it while the
+    job runs and releases it on exit, so a crash frees it within ttl_seconds
+    and a failure frees it at once."""
+    if not await acquire(db, name, ttl_seconds):
+        yield False
+        return
+
+    async def renew():
+        while True:
+            await asyncio.sleep(ttl_seconds / 3)
+            await acquire(db, name, ttl_seconds)
+
+    renewer = asyncio.create_task(renew())
+    try:
+        yield True
+    finally:
+        renewer.cancel()
+        await release(db, name)
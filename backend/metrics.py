@@ -0,0 +1,123 @@
+"""Prometheus metrics for HTTP routes and MongoDB commands.
+
+When PROMETHEUS_MULTIPROC_DIR is set (multi-worker mode) every worker writes
+its samples there and /metrics merges them, so a scrape sees the whole
+process group instead of whichever worker answered.
+"""
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from pymongo import monitoring
+from starlette.responses import Response
+from starlette.routing import Match
+
+REQUEST_LATENCY = Histogram(
+    "smartspend_http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"]
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "smartspend_http_requests_in_flight",
+    "HTTP requests currently being served",
+    ["method", "route"],
+    multiprocess_mode="livesum"
+)
+DB_LATENCY = Histogram(
+    "smartspend_db_command_duration_seconds",
+    "MongoDB command latency by collection and operation",
+    ["collection", "operation"]
+)
+DB_DOCUMENTS = Counter(
+    "smartspend_db_documents_returned_total",
+    "Documents returned by MongoDB cursors",
+    ["collection", "operation"]
+)
+DB_FAILURES = Counter(
+    "smartspend_db_command_failures_total",
+    "MongoDB commands that failed",
+    ["collection", "operation"]
+)
+
+
+def _route_template(app, scope):
+    # Label by template (/api/expenses/{expense_id}) so ids don't explode cardinality
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = _route_template(scope["app"], scope)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method, route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            REQUEST_LATENCY.labels(method, route, str(status["code"])).observe(time.perf_counter() - start)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}
+
+    def _collection(self, event):
+        if event.command_name == "getMore":
+            return event.command.get("collection")
+        value = event.command.get(event.command_name)
+        return value if isinstance(value, str) else None
+
+    def started(self, event):
+        collection = self._collection(event)
+        if collection:
+            self._collections[(event.connection_id, event.request_id)] = collection
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), None)
+        if collection is None:
+            return
+        DB_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        cursor = event.reply.get("cursor")
+        if cursor:
+            batch = cursor.get("firstBatch", cursor.get("nextBatch", []))
+            DB_DOCUMENTS.labels(collection, event.command_name).inc(len(batch))
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), None)
+        if collection is None:
+            return
+        DB_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        DB_FAILURES.labels(collection, event.command_name).inc()
+
+
+command_listener = CommandMetrics()
+
+
+def metrics_response():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,225 @@
+"""Recurring expense templates and the scheduler that materializes them.
+
+A template carries a day-level cron schedule of three fields, ``day-of-month
+month day-of-week`` (e.g. ``1 * *`` for the 1st of every month, ``L * *`` for
+the last day, ``* * 1-5`` for weekdays). Each field takes ``*``, numbers,
+``a-b`` ranges, ``/step`` and comma lists; day-of-week runs 0-6 from Sunday
+and, as in cron, matches either restricted day field.
+
+Each tick loads every due template in batches and writes the occurrences of
+a batch with one ``insert_many``. An occurrence's expense id is derived from
+the template id and the period (the occurrence date), so the existing unique
+(user_id, id) index turns a repeated tick, a restart or a second worker into
+duplicate-key errors that are skipped rather than posted twice. The same
+happens when the user already entered the bill by hand (dedup_key). Only rows
+that were actually inserted reach the rollups.
+
+    python recurring.py   # materialize everything due today
+"""
+import asyncio
+import calendar
+import logging
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import dedup
+import rollups
+
+TEMPLATE_COLLECTION = "recurring_templates"
+BATCH_SIZE = 1000
+# Occurrences posted per template per tick when catching up after downtime
+MAX_CATCH_UP = 366
+# A schedule that matches nothing within this many days is rejected
+SEARCH_DAYS = 366 * 8
+
+# Namespace for occurrence ids, so (template id, period) always maps to the same expense id
+OCCURRENCE_NAMESPACE = uuid.UUID("6f1c3e0a-4b7d-5e2a-9c8f-2d1b0a9e7c31")
+DUPLICATE_KEY = 11000
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_field(field, low, high, allow_last=False):
+    values = set()
+    last = False
+    for part in field.split(","):
+        if allow_last and part == "L":
+            last = True
+            continue
+        base, _, step = part.partition("/")
+        if base == "*":
+            start, end = low, high
+        elif "-" in base:
+            start, end = (int(value) for value in base.split("-", 1))
+        else:
+            start = end = int(base)
+            if step:
+                end = high
+        step = int(step) if step else 1
+        if not (low <= start <= end <= high) or step < 1:
+            raise ValueError("{!r} is outside {}-{}".format(part, low, high))
+        values.update(range(start, end + 1, step))
+    return values, last
+
+
+class Schedule:
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 3:
+            raise ValueError("schedule must have three fields: day-of-month month day-of-week")
+        try:
+            self.days, self.last_day = _parse_field(fields[0], 1, 31, allow_last=True)
+            self.months, _ = _parse_field(fields[1], 1, 12)
+            self.weekdays, _ = _parse_field(fields[2], 0, 7)
+        except ValueError as e:
+            raise ValueError("invalid schedule {!r}: {}".format(expression, e))
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        self.any_day = fields[0] == "*"
+        self.any_weekday = fields[2] == "*"
+        self.expression = expression
+
+    def matches(self, day):
+        if day.month not in self.months:
+            return False
+        on_day = day.day in self.days or (
+            self.last_day and day.day == calendar.monthrange(day.year, day.month)[1]
+        )
+        # Python counts Monday as 0, cron counts Sunday as 0
+        on_weekday = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return on_weekday
+        if self.any_weekday:
+            return on_day
+        return on_day or on_weekday
+
+    def next_on_or_after(self, day, limit=SEARCH_DAYS):
+        for offset in range(limit):
+            candidate = day + timedelta(days=offset)
+            if self.matches(candidate):
+                return candidate
+        return None
+
+
+def first_run(expression, start_date):
+    # Raises ValueError for malformed schedules and for ones that never fire
+    day = Schedule(expression).next_on_or_after(date.fromisoformat(start_date))
+    if day is None:
+        raise ValueError("schedule {!r} never matches a date".format(expression))
+    return day.isoformat()
+
+
+def occurrence_id(template_id, period):
+    return str(uuid.uuid5(OCCURRENCE_NAMESPACE, "{}|{}".format(template_id, period)))
+
+
+async def ensure_indexes(db):
+    await db[TEMPLATE_COLLECTION].create_index([("user_id", ASCENDING), ("id", ASCENDING)], unique=True)
+    # The scheduler looks across all users for due templates, so this one is led by next_run
+    await db[TEMPLATE_COLLECTION].create_index([("next_run", ASCENDING)], partialFilterExpression={"active": True})
+
+
+def _occurrences(template, today):
+    # Every period from next_run up to today, and the next_run that follows them
+    schedule = Schedule(template['schedule'])
+    end = today
+    if template.get('end_date'):
+        end = min(end, date.fromisoformat(template['end_date']))
+    periods = []
+    day = date.fromisoformat(template['next_run'])
+    while day is not None and day <= end and len(periods) < MAX_CATCH_UP:
+        periods.append(day.isoformat())
+        day = schedule.next_on_or_after(day + timedelta(days=1))
+    if day is not None and template.get('end_date') and day.isoformat() > template['end_date']:
+        day = None
+    return periods, day.isoformat() if day else None
+
+
+async def _materialize_batch(db, templates, today):
+    docs = []
+    advances = []
+    created_at = datetime.utcnow()
+    for template in templates:
+        periods, next_run = _occurrences(template, today)
+        for period in periods:
+            doc = {
+                "id": occurrence_id(template['id'], period),
+                "user_id": template['user_id'],
+                "amount": template['amount'],
+                "category": template['category'],
+                "description": template['description'],
+                "date": period,
+                "created_at": created_at,
+                "recurring_id": template['id']
+            }
+            doc['dedup_key'] = dedup.fingerprint(doc)
+            docs.append(doc)
+        # Only advance from the next_run we read, so a concurrent tick cannot move it twice
+        update = {"$set": {"next_run": next_run, "active": next_run is not None}}
+        if periods:
+            update["$set"]["last_period"] = periods[-1]
+        advances.append(UpdateOne(
+            {"user_id": template['user_id'], "id": template['id'], "next_run": template['next_run']}, update
+        ))
+
+    failed = set()
+    if docs:
+        try:
+            await db.expenses.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details['writeErrors']:
+                failed.add(write_error['index'])
+                if write_error['code'] != DUPLICATE_KEY:
+                    logger.error("Recurring expense %s not posted: %s", docs[write_error['index']]['id'],
+                                 write_error['errmsg'])
+    inserted = [doc for index, doc in enumerate(docs) if index not in failed]
+    await rollups.apply_expenses(db, inserted)
+    if advances:
+        await db[TEMPLATE_COLLECTION].bulk_write(advances, ordered=False)
+    return inserted
+
+
+async def materialize_due(db, today=None, batch_size=BATCH_SIZE):
+    """Post every due occurrence; returns the number inserted per user."""
+    today = today or datetime.utcnow().date()
+    cursor = db[TEMPLATE_COLLECTION].find(
+        {"active": True, "next_run": {"$lte": today.isoformat()}}, {"_id": 0}
+    ).batch_size(batch_size)
+    posted = {}
+    batch = []
+
+    async def flush(batch):
+        for doc in await _materialize_batch(db, batch, today):
+            posted[doc['user_id']] = posted.get(doc['user_id'], 0) + 1
+
+    async for template in cursor:
+        batch.append(template)
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    return posted
+
+
+async def _main():
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        db = client[os.environ['DB_NAME']]
+        await ensure_indexes(db)
+        posted = await materialize_due(db)
+        print("Posted {} recurring expenses for {} users".format(sum(posted.values()), len(posted)))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,289 @@
+"""Columnar snapshots of all expenses for long-range reports.
+
+A snapshot copies ``expenses`` plus everything archived into NumPy column
+files partitioned by month::
+
+    REPORTS_DIR/<snapshot>/manifest.json
+    REPORTS_DIR/<snapshot>/2025-03/{user,category,day,amount}.npy
+    REPORTS_DIR/CURRENT            # name of the live snapshot
+
+Users and categories are stored as integer codes (their names are in the
+manifest) and each partition is sorted by user, so one user's rows in a month
+are a contiguous slice found by binary search. Partitions are memory-mapped,
+so workers share them through the page cache, and reports are vectorized
+group-bys that never touch MongoDB. Reports are as fresh as the last
+snapshot, which is reported with each result. Rows whose date or amount cannot
+be stored in a column (written before dates were validated, say) are left out
+and counted in the manifest rather than failing the snapshot.
+
+    python reports.py   # write a new snapshot
+"""
+import asyncio
+import json
+import os
+import re
+import shutil
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+import archive
+
+COLUMNS = ("user", "category", "day", "amount")
+PROJECTION = {"_id": 0, "user_id": 1, "category": 1, "date": 1, "amount": 1}
+BATCH_SIZE = 50000
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+# Snapshots kept on disk besides the live one, for workers still reading them
+KEEP_SNAPSHOTS = 1
+
+
+class _Columns:
+    """Accumulates documents into column arrays a batch at a time."""
+
+    def __init__(self):
+        self.users = {}
+        self.categories = {}
+        self._batch = []
+        self._chunks = {name: [] for name in COLUMNS}
+        self.skipped = 0
+
+    @staticmethod
+    def _valid(doc):
+        day, amount = doc.get('date'), doc.get('amount')
+        if not isinstance(amount, (int, float)) or isinstance(amount, bool):
+            return False
+        if not isinstance(day, str) or not ISO_DATE.fullmatch(day):
+            return False
+        try:
+            date.fromisoformat(day)
+        except ValueError:
+            return False
+        return True
+
+    def add(self, doc):
+        if not self._valid(doc):
+            self.skipped += 1
+            return
+        self._batch.append((
+            self.users.setdefault(doc['user_id'], len(self.users)),
+            self.categories.setdefault(doc['category'], len(self.categories)),
+            doc['date'],
+            doc['amount']
+        ))
+        if len(self._batch) >= BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        user, category, day, amount = zip(*self._batch)
+        self._chunks["user"].append(np.array(user, dtype=np.int32))
+        self._chunks["category"].append(np.array(category, dtype=np.int16))
+        self._chunks["day"].append(np.array(day, dtype="datetime64[D]"))
+        self._chunks["amount"].append(np.array(amount, dtype=np.float64))
+        self._batch = []
+
+    def arrays(self):
+        self._flush()
+        empty = {"user": np.int32, "category": np.int16, "day": "datetime64[D]", "amount": np.float64}
+        return {
+            name: np.concatenate(chunks) if chunks else np.array([], dtype=empty[name])
+            for name, chunks in self._chunks.items()
+        }
+
+
+def _write_snapshot(root, name, columns):
+    arrays = columns.arrays()
+    months = arrays["day"].astype("datetime64[M]")
+    order = np.lexsort((arrays["day"], arrays["user"], months))
+    arrays = {key: value[order] for key, value in arrays.items()}
+    months = months[order]
+
+    directory = root / name
+    partitions = {}
+    month_values, starts, counts = np.unique(months, return_index=True, return_counts=True)
+    for month, start, count in zip(month_values, starts, counts):
+        label = str(month)
+        (directory / label).mkdir(parents=True, exist_ok=True)
+        for key, value in arrays.items():
+            np.save(directory / label / "{}.npy".format(key), value[start:start + count])
+        partitions[label] = int(count)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "generated_at": datetime.utcnow().isoformat(),
+        "rows": int(len(order)),
+        "skipped": columns.skipped,
+        "users": list(columns.users),
+        "categories": list(columns.categories),
+        "months": partitions
+    }
+    (directory / "manifest.json").write_text(json.dumps(manifest))
+
+    # Readers follow CURRENT, so swapping it is the only step they can observe
+    pointer = root / "CURRENT.tmp"
+    pointer.write_text(name)
+    os.replace(pointer, root / "CURRENT")
+
+    snapshots = sorted(path for path in root.iterdir() if path.is_dir() and path.name != name)
+    for old in snapshots[:max(len(snapshots) - KEEP_SNAPSHOTS, 0)]:
+        shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+async def snapshot(db, root):
+    columns = _Columns()
+    async for doc in db.expenses.find({}, PROJECTION).batch_size(10000):
+        columns.add(doc)
+    async for doc in archive.iter_archived(db, PROJECTION):
+        columns.add(doc)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    name = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    return await asyncio.to_thread(_write_snapshot, root, name, columns)
+
+
+def _month_range(start, end):
+    return np.arange(np.datetime64(start, "M"), np.datetime64(end, "M") + 1)
+
+
+class ReportEngine:
+    def __init__(self, root):
+        self.root = Path(root)
+        self._name = None
+        self.manifest = None
+        self._users = {}
+        self._partitions = {}
+
+    def refresh(self):
+        # Reading a few bytes per request lets every worker pick up a new snapshot
+        try:
+            name = (self.root / "CURRENT").read_text().strip()
+        except FileNotFoundError:
+            return False
+        if name != self._name:
+            manifest = json.loads((self.root / name / "manifest.json").read_text())
+            self._name, self.manifest = name, manifest
+            self._users = {user_id: code for code, user_id in enumerate(manifest['users'])}
+            self._partitions = {}
+        return True
+
+    def _partition(self, month):
+        partition = self._partitions.get(month)
+        if partition is None:
+            directory = self.root / self._name / month
+            partition = {
+                key: np.load(directory / "{}.npy".format(key), mmap_mode="r") for key in COLUMNS
+            }
+            self._partitions[month] = partition
+        return partition
+
+    def columns(self, user_id, start, end):
+        """(category codes, days, amounts) of one user's rows in [start, end] months."""
+        code = self._users.get(user_id)
+        parts = []
+        if code is not None:
+            for month in _month_range(start, end):
+                label = str(month)
+                if label not in self.manifest['months']:
+                    continue
+                partition = self._partition(label)
+                lo, hi = np.searchsorted(partition["user"], [code, code + 1])
+                if hi > lo:
+                    parts.append((partition["category"][lo:hi], partition["day"][lo:hi], partition["amount"][lo:hi]))
+        if not parts:
+            return np.array([], np.int16), np.array([], "datetime64[D]"), np.array([], np.float64)
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    @property
+    def categories(self):
+        return self.manifest['categories']
+
+    def info(self):
+        if not self.manifest:
+            return {"snapshot": None}
+        return {
+            "snapshot": self._name,
+            "generated_at": self.manifest['generated_at'],
+            "rows": self.manifest['rows'],
+            "skipped": self.manifest.get('skipped', 0),
+            "users": len(self.manifest['users']),
+            "months": len(self.manifest['months'])
+        }
+
+    def _by_category(self, totals):
+        return {
+            name: totals[code].tolist() for code, name in enumerate(self.categories) if totals[code].any()
+        }
+
+    def year_over_year(self, user_id, years, today, ytd=False):
+        first = today.year - years + 1
+        category, day, amount = self.columns(user_id, "{}-01".format(first), today.strftime("%Y-%m"))
+        year = day.astype("datetime64[Y]").astype(int) + 1970 - first
+        if ytd:
+            # Compare the same stretch of every year: January 1st up to today's day of the year
+            day_of_year = (day - day.astype("datetime64[Y]")).astype(int)
+            keep = day_of_year <= today.timetuple().tm_yday - 1
+            category, year, amount = category[keep], year[keep], amount[keep]
+        ncat = len(self.categories)
+        totals = np.bincount(category * years + year, weights=amount, minlength=ncat * years).reshape(ncat, years)
+        yearly = totals.sum(axis=0)
+        change = np.full_like(totals, np.nan)
+        np.divide(totals[:, 1:] - totals[:, :-1], totals[:, :-1], out=change[:, 1:], where=totals[:, :-1] > 0)
+        return {
+            "years": list(range(first, today.year + 1)),
+            "ytd": ytd,
+            "totals": yearly.tolist(),
+            "categories": self._by_category(totals),
+            "change": {
+                name: [None if np.isnan(value) else value for value in change[code].tolist()]
+                for code, name in enumerate(self.categories) if totals[code].any()
+            }
+        }
+
+    def pivot(self, user_id, start, end):
+        category, day, amount = self.columns(user_id, start, end)
+        months = _month_range(start, end)
+        index = (day.astype("datetime64[M]") - months[0]).astype(int)
+        ncat, nmonths = len(self.categories), len(months)
+        totals = np.bincount(category * nmonths + index, weights=amount, minlength=ncat * nmonths).reshape(ncat, nmonths)
+        return {
+            "months": [str(month) for month in months],
+            "totals": totals.sum(axis=0).tolist(),
+            "categories": self._by_category(totals)
+        }
+
+    def percentiles(self, user_id, start, end, quantiles, today):
+        category, day, amount = self.columns(user_id, start, end)
+        result = {"expense": {}, "daily": None}
+        if not len(amount):
+            return result
+        for code, name in enumerate(self.categories):
+            values = amount[category == code]
+            if len(values):
+                result["expense"][name] = dict(zip(map(str, quantiles), np.percentile(values, quantiles).tolist()))
+        result["expense"]["all"] = dict(zip(map(str, quantiles), np.percentile(amount, quantiles).tolist()))
+        # Spend per calendar day in the range, days without expenses counting as zero
+        first, last = np.datetime64(start, "M").astype("datetime64[D]"), np.datetime64(end, "M") + 1
+        last = min(last.astype("datetime64[D]"), np.datetime64(today) + 1)
+        daily = np.bincount((day - first).astype(int), weights=amount, minlength=max(int((last - first).astype(int)), 1))
+        result["daily"] = dict(zip(map(str, quantiles), np.percentile(daily, quantiles).tolist()))
+        return result
+
+
+async def _main():
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        manifest = await snapshot(client[os.environ['DB_NAME']], os.environ.get('REPORTS_DIR', 'report_snapshots'))
+        print("Snapshot of {} expenses over {} months, {} malformed rows skipped".format(
+            manifest['rows'], len(manifest['months']), manifest['skipped']))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,276 @@
+"""Pre-aggregated (user, day, category) spending rollups.
+
+Every expense write adjusts the matching rollup document with ``$inc`` so the
+dashboard and analytics routes can read a handful of rollups instead of
+scanning raw expenses. A second collection keeps one document per user and
+month with the month's total and per-category totals, which budget checks
+read back from the same ``$inc`` that updates it. Run ``python rollups.py
+rebuild`` to regenerate both from ``expenses`` and ``python rollups.py check``
+to compare them; both add back the totals of rows moved out by the archive
+job. At startup the server builds whatever is missing on an upgraded install:
+everything when there are expenses but no day rollups, or the month totals
+from the day rollups when only those exist.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReplaceOne, ReturnDocument, UpdateOne
+
+import archive
+
+ROLLUP_COLLECTION = "expense_rollups"
+MONTH_COLLECTION = "expense_month_totals"
+
+# Float sums drift slightly under repeated $inc, so totals are compared loosely
+TOLERANCE = 0.005
+
+
+def _key(expense):
+    return {"user_id": expense['user_id'], "day": expense['date'], "category": expense['category']}
+
+
+def _inc_op(key, amount, count):
+    # Only additions create a bucket; taking an expense out of a missing one would leave count -1
+    return UpdateOne(key, {"$inc": {"total": amount, "count": count}}, upsert=count > 0)
+
+
+def month_id(user_id, month):
+    return "{}|{}".format(user_id, month)
+
+
+def _month_update(user_id, month, categories):
+    # categories maps category -> (amount, count) for one user and month
+    inc = {"total": 0.0, "count": 0}
+    for category, (amount, count) in categories.items():
+        inc["total"] += amount
+        inc["count"] += count
+        inc["categories.{}".format(category)] = amount
+    return {"$inc": inc, "$setOnInsert": {"user_id": user_id, "month": month}}
+
+
+def _month_ops(buckets):
+    # buckets maps (user_id, day, category) -> (amount, count)
+    months = {}
+    for (user_id, day, category), (amount, count) in buckets.items():
+        categories = months.setdefault((user_id, day[:7]), {})
+        total, n = categories.get(category, (0.0, 0))
+        categories[category] = (total + amount, n + count)
+    # As with days, a month is only created by a change that adds to every category it touches
+    return [
+        UpdateOne(
+            {"_id": month_id(user_id, month)},
+            _month_update(user_id, month, categories),
+            upsert=all(count > 0 for _, count in categories.values())
+        )
+        for (user_id, month), categories in months.items()
+    ]
+
+
+async def ensure_indexes(db):
+    await db[ROLLUP_COLLECTION].create_index(
+        [("user_id", ASCENDING), ("day", ASCENDING), ("category", ASCENDING)], unique=True
+    )
+
+
+async def apply_expense(db, expense, sign=1):
+    """Adjust the day and month rollups; returns the month totals after the change."""
+    category = getattr(expense['category'], "value", expense['category'])
+    month = expense['date'][:7]
+    _, month_totals = await asyncio.gather(
+        db[ROLLUP_COLLECTION].update_one(
+            _key(expense),
+            {"$inc": {"total": sign * expense['amount'], "count": sign}},
+            upsert=sign > 0
+        ),
+        db[MONTH_COLLECTION].find_one_and_update(
+            {"_id": month_id(expense['user_id'], month)},
+            _month_update(expense['user_id'], month, {category: (sign * expense['amount'], sign)}),
+            upsert=sign > 0,
+            return_document=ReturnDocument.AFTER
+        )
+    )
+    return month_totals
+
+
+async def move_expense(db, old, new):
+    # Take the old amount out of its bucket and add the new one, one round trip per collection.
+    # Ordered, so when the old bucket is missing the removal is a no-op rather than netted into the addition
+    ops = [
+        _inc_op(_key(old), -old['amount'], -1),
+        _inc_op(_key(new), new['amount'], 1),
+    ]
+    month_ops = [
+        op
+        for doc, sign in ((old, -1), (new, 1))
+        for op in _month_ops({
+            (doc['user_id'], doc['date'], getattr(doc['category'], "value", doc['category'])):
+                (sign * doc['amount'], sign)
+        })
+    ]
+    await asyncio.gather(
+        db[ROLLUP_COLLECTION].bulk_write(ops),
+        db[MONTH_COLLECTION].bulk_write(month_ops)
+    )
+
+
+async def apply_expenses(db, expenses, sign=1):
+    # Collapse a batch into one $inc per bucket so bulk imports cost one round trip
+    buckets = {}
+    for expense in expenses:
+        key = (expense['user_id'], expense['date'], getattr(expense['category'], "value", expense['category']))
+        total, count = buckets.get(key, (0, 0))
+        buckets[key] = (total + sign * expense['amount'], count + sign)
+    if not buckets:
+        return
+    ops = [
+        _inc_op({"user_id": user_id, "day": day, "category": category}, total, count)
+        for (user_id, day, category), (total, count) in buckets.items()
+    ]
+    await asyncio.gather(
+        db[ROLLUP_COLLECTION].bulk_write(ops, ordered=False),
+        db[MONTH_COLLECTION].bulk_write(_month_ops(buckets), ordered=False)
+    )
+
+
+async def _months_from_days(db):
+    months = {}
+    async for row in db[ROLLUP_COLLECTION].find({"count": {"$ne": 0}}, {"_id": 0}):
+        key = (row['user_id'], row['day'][:7])
+        doc = months.setdefault(key, {
+            "_id": month_id(*key), "user_id": key[0], "month": key[1], "total": 0.0, "count": 0, "categories": {}
+        })
+        doc["total"] += row['total']
+        doc["count"] += row['count']
+        doc["categories"][row['category']] = doc["categories"].get(row['category'], 0.0) + row['total']
+    return months
+
+
+async def rebuild(db):
+    pipeline = [
+        {"$group": {
+            "_id": {"user_id": "$user_id", "day": "$date", "category": "$category"},
+            "total": {"$sum": "$amount"},
+            "count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "user_id": "$_id.user_id",
+            "day": "$_id.day",
+            "category": "$_id.category",
+            "total": 1,
+            "count": 1
+        }},
+        {"$out": ROLLUP_COLLECTION}
+    ]
+    await db.expenses.aggregate(pipeline).to_list(None)
+    await ensure_indexes(db)
+
+    # Archived rows are gone from expenses but still count towards their days
+    archived = await archive.archived_buckets(db)
+    if archived:
+        ops = [
+            _inc_op({"user_id": user_id, "day": day, "category": category}, total, count)
+            for (user_id, day, category), (total, count) in archived.items()
+        ]
+        await db[ROLLUP_COLLECTION].bulk_write(ops, ordered=False)
+
+    await db[MONTH_COLLECTION].delete_many({})
+    await rebuild_months(db)
+    return await db[ROLLUP_COLLECTION].count_documents({})
+
+
+async def rebuild_months(db):
+    """Write every month total from the day rollups; returns the number of months."""
+    # Replaced rather than inserted, so a month a live write created meanwhile is overwritten, not a conflict
+    months = [ReplaceOne({"_id": doc['_id']}, doc, upsert=True) for doc in (await _months_from_days(db)).values()]
+    for start in range(0, len(months), 5000):
+        await db[MONTH_COLLECTION].bulk_write(months[start:start + 5000], ordered=False)
+    return len(months)
+
+
+async def backfill(db):
+    """Build the rollups an upgraded install lacks; returns (days, months) written, or None if none were missing."""
+    if not await db[ROLLUP_COLLECTION].find_one({}, {"_id": 1}):
+        if not await db.expenses.find_one({}, {"_id": 1}):
+            return None
+        days = await rebuild(db)
+        return days, await db[MONTH_COLLECTION].count_documents({})
+    if not await db[MONTH_COLLECTION].find_one({}, {"_id": 1}):
+        return 0, await rebuild_months(db)
+    return None
+
+
+async def check(db):
+    expected = {}
+    pipeline = [{"$group": {
+        "_id": {"user_id": "$user_id", "day": "$date", "category": "$category"},
+        "total": {"$sum": "$amount"},
+        "count": {"$sum": 1}
+    }}]
+    async for row in db.expenses.aggregate(pipeline):
+        key = (row['_id']['user_id'], row['_id']['day'], row['_id']['category'])
+        expected[key] = (row['total'], row['count'])
+    for key, (total, count) in (await archive.archived_buckets(db)).items():
+        exp_total, exp_count = expected.get(key, (0, 0))
+        expected[key] = (exp_total + total, exp_count + count)
+
+    actual = {}
+    async for row in db[ROLLUP_COLLECTION].find({}, {"_id": 0}):
+        actual[(row['user_id'], row['day'], row['category'])] = (row['total'], row['count'])
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        exp_total, exp_count = expected.get(key, (0, 0))
+        act_total, act_count = actual.get(key, (0, 0))
+        if exp_count != act_count or abs(exp_total - act_total) > TOLERANCE:
+            mismatches.append({
+                "user_id": key[0],
+                "day": key[1],
+                "category": key[2],
+                "expected_total": exp_total,
+                "expected_count": exp_count,
+                "rollup_total": act_total,
+                "rollup_count": act_count
+            })
+
+    # Month totals have to agree with the day rollups they summarize
+    expected_months = await _months_from_days(db)
+    async for doc in db[MONTH_COLLECTION].find({}):
+        expected_doc = expected_months.pop((doc['user_id'], doc['month']), None)
+        exp_total, exp_count = (expected_doc['total'], expected_doc['count']) if expected_doc else (0, 0)
+        if exp_count != doc['count'] or abs(exp_total - doc['total']) > TOLERANCE:
+            mismatches.append({"user_id": doc['user_id'], "month": doc['month'], "expected_total": exp_total,
+                               "expected_count": exp_count, "rollup_total": doc['total'], "rollup_count": doc['count']})
+    for (user_id, month), doc in expected_months.items():
+        mismatches.append({"user_id": user_id, "month": month, "expected_total": doc['total'],
+                           "expected_count": doc['count'], "rollup_total": 0, "rollup_count": 0})
+    return mismatches
+
+
+async def _main(command):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if command == "rebuild":
+            count = await rebuild(db)
+            print("Rebuilt {} rollup documents".format(count))
+            return 0
+        mismatches = await check(db)
+        for row in mismatches:
+            print(row)
+        print("{} mismatched rollup buckets".format(len(mismatches)))
+        return 1 if mismatches else 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2 or sys.argv[1] not in ("rebuild", "check"):
+        print("usage: python rollups.py rebuild|check")
+        sys.exit(2)
+    sys.exit(asyncio.run(_main(sys.argv[1])))
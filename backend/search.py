@@ -0,0 +1,167 @@
+"""Expense search: MongoDB text matching plus an in-process trigram index.
+
+The text index finds whole (stemmed) words. For prefixes and typos every
+worker keeps, per user, the distinct words of their descriptions and the
+trigrams of those words. A query token matches the words it is a prefix of
+or shares enough trigrams with, and the descriptions containing them are
+fetched with ``$in`` on the (user_id, description, date) index. Users repeat
+descriptions heavily, so the index is small next to the expenses it covers.
+
+Each user's index remembers the ``expenses:<user>`` cache generation it
+covers. Writes in this worker add their descriptions and advance it; a write
+anywhere else (another worker, or a recurring post whose descriptions the
+writer does not pass along) leaves it behind. A search never waits for the
+index: a missing or stale one is rebuilt in a background task from a
+distinct scan of the user's descriptions, and until it lands the search uses
+the stale index, or ``$text`` alone when there is none.
+"""
+import asyncio
+import logging
+import re
+from collections import Counter, OrderedDict
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+# Trigram Jaccard similarity a word needs to count as a typo of the query token
+SIMILARITY = 0.35
+# Descriptions passed to $in per search
+MAX_CANDIDATES = 500
+SEARCH_ORDER = [("date", DESCENDING), ("created_at", DESCENDING)]
+
+_WORD = re.compile(r"\w+")
+
+logger = logging.getLogger(__name__)
+
+
+def _tokens(text):
+    return _WORD.findall(text.lower())
+
+
+def _grams(word):
+    padded = "  {} ".format(word)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+async def ensure_indexes(db):
+    # A text index led by user_id only serves queries with user_id equality, which all of ours have
+    await db.expenses.create_index([("user_id", ASCENDING), ("description", TEXT)])
+    await db.expenses.create_index([("user_id", ASCENDING), ("description", ASCENDING), ("date", DESCENDING)])
+
+
+class _UserIndex:
+    def __init__(self, generation):
+        self.generation = generation
+        self.words = {}
+        self.gram_counts = {}
+        self.grams = {}
+
+    def add(self, description):
+        for word in _tokens(description):
+            descriptions = self.words.get(word)
+            if descriptions is None:
+                descriptions = self.words[word] = set()
+                grams = _grams(word)
+                self.gram_counts[word] = len(grams)
+                for gram in grams:
+                    self.grams.setdefault(gram, set()).add(word)
+            descriptions.add(description)
+
+    def _similar_words(self, token):
+        grams = _grams(token)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.grams.get(gram, ()))
+        return {
+            word for word, count in shared.items()
+            if word.startswith(token) or count / (len(grams) + self.gram_counts[word] - count) >= SIMILARITY
+        }
+
+    def match(self, q):
+        # Every query token has to match some word of the description
+        result = None
+        for token in _tokens(q):
+            descriptions = set()
+            for word in self._similar_words(token):
+                descriptions |= self.words[word]
+            result = descriptions if result is None else result & descriptions
+            if not result:
+                break
+        return result or set()
+
+
+class SearchIndex:
+    def __init__(self, max_users=1000):
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._rebuilding = {}
+        self.rebuilds = 0
+
+    def get(self, db, user_id, generation):
+        """The user's index, possibly behind ``generation``, or None; never waits on a rebuild."""
+        index = self._users.get(user_id)
+        if (index is None or index.generation != generation) and user_id not in self._rebuilding:
+            task = asyncio.create_task(self.rebuild(db, user_id, generation))
+            self._rebuilding[user_id] = task
+            task.add_done_callback(lambda _: self._rebuilding.pop(user_id, None))
+        if index is not None:
+            self._users.move_to_end(user_id)
+        return index
+
+    async def rebuild(self, db, user_id, generation):
+        try:
+            index = _UserIndex(generation)
+            pipeline = [{"$match": {"user_id": user_id}}, {"$group": {"_id": "$description"}}]
+            async for row in db.expenses.aggregate(pipeline):
+                index.add(row['_id'])
+        except Exception:
+            logger.exception("Search index rebuild failed for %s", user_id)
+            return
+        # Writes that landed during the scan advanced the generation past this one,
+        # so the next search after them schedules another rebuild
+        current = self._users.get(user_id)
+        if current is not None and current.generation > generation:
+            return
+        self._users[user_id] = index
+        self._users.move_to_end(user_id)
+        self.rebuilds += 1
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def add(self, user_id, descriptions, generation):
+        index = self._users.get(user_id)
+        if index is None:
+            return
+        # Known descriptions always go in, so this worker's own writes are searchable at once.
+        # The generation only advances when nothing else was written in between; otherwise
+        # the index stays behind and the next search rebuilds it in the background
+        for description in descriptions or ():
+            index.add(description)
+        if descriptions is not None and index.generation == generation - 1:
+            index.generation = generation
+
+    def stats(self):
+        return {
+            "users": len(self._users),
+            "words": sum(len(index.words) for index in self._users.values()),
+            "rebuilding": len(self._rebuilding),
+            "rebuilds": self.rebuilds
+        }
+
+
+async def search(db, index, query, q, limit):
+    """Newest-first expenses matching ``query`` whose description matches ``q``.
+
+    ``index`` may be None while the user's first build runs; only ``$text`` matches are found then.
+    """
+    descriptions = sorted(index.match(q))[:MAX_CANDIDATES] if index is not None else []
+    text_cursor = db.expenses.find({**query, "$text": {"$search": q}}, {"_id": 0, "dedup_key": 0})
+    lookups = [text_cursor.sort(SEARCH_ORDER).limit(limit).to_list(limit)]
+    if descriptions:
+        fuzzy_cursor = db.expenses.find({**query, "description": {"$in": descriptions}}, {"_id": 0, "dedup_key": 0})
+        lookups.append(fuzzy_cursor.sort(SEARCH_ORDER).limit(limit).to_list(limit))
+
+    merged = {}
+    for hits in await asyncio.gather(*lookups):
+        for expense in hits:
+            merged[expense['id']] = expense
+    return sorted(merged.values(), key=lambda e: (e['date'], e['created_at']), reverse=True)[:limit]
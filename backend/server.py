@@ -1,26 +1,137 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Body, Depends, HTTPException, Header, Request, Response, UploadFile, File
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from typing import Dict, List, Optional
+from contextlib import asynccontextmanager
 import uuid
-from datetime import datetime
+import asyncio
+import json
+import base64
+import jwt
+import orjson
+import re
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from enum import Enum
 
+import archive
+import budgets
+import cache as response_cache
+import dedup
+import events
+import export
+import forecast
+import importers
+import locks
+import metrics
+import recurring
+import reports
+import rollups
+import search
+import tenancy
+import writebehind
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection, opened by the app lifespan so readiness reflects a real ping
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = None
+db = None
+
+MONGO_POOL_OPTIONS = {
+    "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', '10')),
+    "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+    "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+    "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    "socketTimeoutMS": int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000')),
+}
+
+# Rows per insert_many call for bulk ingestion
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '1000'))
+
+# Worker processes serving this app (set by entrypoint.sh); >1 means no state may be process-local
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+
+# Response cache for dashboard/analytics, invalidated by write-route generation bumps.
+# With several workers the in-process LRU keeps generations in Mongo so all workers agree
+cache = response_cache.create_cache(
+    backend=os.environ.get('CACHE_BACKEND', 'memory'),
+    redis_url=os.environ.get('REDIS_URL', 'redis://localhost:6379/0'),
+    ttl=int(os.environ.get('CACHE_TTL_SECONDS', '60')),
+    max_entries=int(os.environ.get('CACHE_MAX_ENTRIES', '256')),
+    counters=response_cache.MongoCounters(lambda: db) if WEB_CONCURRENCY > 1 else None
+)
+
+# Owner of every request when JWT_SECRET is unset (a single-user install), and of pre-tenancy data
+DEFAULT_USER_ID = os.environ.get('DEFAULT_USER_ID', 'default')
+
+# With JWT_SECRET set, each request must carry "Authorization: Bearer <token>" signed with it,
+# and the token's sub claim is the user; tokens are issued by whatever handles sign-in
+JWT_SECRET = os.environ.get('JWT_SECRET')
+JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
+
+# How often the background job recomputes spend forecasts (0 disables it)
+FORECAST_REFRESH_SECONDS = int(os.environ.get('FORECAST_REFRESH_SECONDS', '3600'))
+
+# Live dashboard events: "auto" uses change streams when the server supports them
+EVENTS_SOURCE = os.environ.get('EVENTS_SOURCE', 'auto')
+# Idle SSE connections get a comment line this often so proxies keep them open
+EVENTS_HEARTBEAT_SECONDS = int(os.environ.get('EVENTS_HEARTBEAT_SECONDS', '15'))
+live = events.EventBus()
+
+# Monthly limit shown when a user has not set an overall budget
+DEFAULT_MONTHLY_LIMIT = float(os.environ.get('DEFAULT_MONTHLY_LIMIT', '5000'))
+# Budgets are read on every expense write; a budget edit reaches other workers within this TTL
+budget_cache = budgets.BudgetCache(ttl=int(os.environ.get('BUDGET_CACHE_SECONDS', '30')))
+
+# Per-user trigram indexes of expense descriptions for fuzzy search
+search_index = search.SearchIndex(max_users=int(os.environ.get('SEARCH_INDEX_MAX_USERS', '1000')))
+
+# How often the scheduler posts due recurring expenses (0 disables it)
+RECURRING_INTERVAL_SECONDS = int(os.environ.get('RECURRING_INTERVAL_SECONDS', '300'))
+
+# Columnar report snapshots; with several hosts REPORTS_DIR must be shared storage
+REPORTS_DIR = os.environ.get('REPORTS_DIR', 'report_snapshots')
+# How often a new snapshot is written (0 disables it; run reports.py from cron instead)
+REPORT_SNAPSHOT_SECONDS = int(os.environ.get('REPORT_SNAPSHOT_SECONDS', '3600'))
+report_engine = reports.ReportEngine(REPORTS_DIR)
+
+# Opt-in write-behind: single expense inserts are coalesced into insert_many batches
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+write_buffer = writebehind.WriteBehind(
+    max_batch=int(os.environ.get('WRITE_BEHIND_MAX_BATCH', '500')),
+    max_delay=int(os.environ.get('WRITE_BEHIND_MAX_DELAY_MS', '5')) / 1000,
+    max_pending=int(os.environ.get('WRITE_BEHIND_MAX_PENDING', '10000'))
+) if WRITE_BEHIND else None
+
+@asynccontextmanager
+async def lifespan(app):
+    # An unreachable database or a failed index build aborts startup rather than serving
+    # without one; the process exits and the entrypoint (or supervisor) sees it
+    await connect_db_client()
+    await ensure_indexes()
+    start_backfills()
+    await start_forecast_job()
+    await start_recurring_job()
+    await start_report_job()
+    await start_event_source()
+    if write_buffer:
+        write_buffer.start(db)
+    yield
+    await shutdown_db_client()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -36,20 +147,112 @@ class ExpenseCategory(str, Enum):
     EDUCATION = "Education"
     OTHER = "Other"
 
+# Every query is scoped to the caller's user_id, and every index leads with it,
+# so a user's reads touch only their own data and the collections can be sharded
+# on user_id without scatter-gather queries
+_UNAUTHORIZED = {"status_code": 401, "headers": {"WWW-Authenticate": "Bearer"}}
+
+def _verified_claims(token):
+    if not token:
+        raise HTTPException(detail="Missing bearer token", **_UNAUTHORIZED)
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM], options={"require": ["sub"]})
+    except jwt.InvalidTokenError as e:
+        raise HTTPException(detail="Invalid token: {}".format(e), **_UNAUTHORIZED)
+
+def _verified_user_id(token):
+    if not JWT_SECRET:
+        return DEFAULT_USER_ID
+    user_id = str(_verified_claims(token)['sub']).strip()
+    if not user_id or len(user_id) > 128:
+        raise HTTPException(detail="Invalid token subject", **_UNAUTHORIZED)
+    return user_id
+
+def _bearer(authorization):
+    scheme, _, token = (authorization or "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else None
+
+async def get_user_id(authorization: Optional[str] = Header(None)):
+    return _verified_user_id(_bearer(authorization))
+
+# /api is proxied publicly, so the admin routes need a token carrying "admin": true;
+# without JWT_SECRET there is no way to tell an operator from anyone else and they are off
+async def require_admin(authorization: Optional[str] = Header(None)):
+    if not JWT_SECRET:
+        raise HTTPException(status_code=403, detail="Admin routes need JWT_SECRET to be set")
+    if _verified_claims(_bearer(authorization)).get('admin') is not True:
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 # Models
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
 class ExpenseCreate(BaseModel):
     amount: float
     category: ExpenseCategory
     description: str
     date: str = Field(default_factory=lambda: datetime.utcnow().date().isoformat())
 
+    @field_validator("date")
+    @classmethod
+    def _iso_date(cls, value):
+        # Rollups, reports and range filters all compare dates as YYYY-MM-DD strings
+        try:
+            if ISO_DATE.fullmatch(value):
+                date.fromisoformat(value)
+                return value
+        except ValueError:
+            pass
+        raise ValueError("date must be a calendar date as YYYY-MM-DD")
+
 class Expense(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     amount: float
     category: ExpenseCategory
     description: str
     date: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    recurring_id: Optional[str] = None
+
+class BudgetAlert(BaseModel):
+    month: str
+    scope: str
+    limit: float
+    spent: float
+    crossed: bool = False
+    created_at: Optional[datetime] = None
+
+class BudgetUpdate(BaseModel):
+    overall: Optional[float] = None
+    categories: Dict[ExpenseCategory, float] = {}
+
+class Budget(BaseModel):
+    user_id: str = DEFAULT_USER_ID
+    overall: Optional[float] = None
+    categories: Dict[str, float] = {}
+    updated_at: Optional[datetime] = None
+
+class RecurringExpenseCreate(BaseModel):
+    amount: float
+    category: ExpenseCategory = ExpenseCategory.BILLS
+    description: str
+    schedule: str
+    start_date: str = Field(default_factory=lambda: datetime.utcnow().date().isoformat())
+    end_date: Optional[str] = None
+
+class RecurringExpense(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
+    amount: float
+    category: ExpenseCategory
+    description: str
+    schedule: str
+    start_date: str
+    end_date: Optional[str] = None
+    next_run: Optional[str] = None
+    last_period: Optional[str] = None
+    active: bool = True
+    created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class SavingsGoalCreate(BaseModel):
     title: str
@@ -58,6 +261,7 @@ class SavingsGoalCreate(BaseModel):
 
 class SavingsGoal(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     title: str
     target_amount: float
     current_amount: float = 0.0
@@ -71,6 +275,39 @@ class DashboardData(BaseModel):
     recent_expenses: List[Expense]
     monthly_limit: Optional[float] = 5000.0
     remaining_budget: float
+    forecast: Optional[dict] = None
+    budget_alerts: List[BudgetAlert] = []
+
+class ExpenseUpdated(Expense):
+    # The refreshed dashboard, when the write asked for include_dashboard
+    dashboard: Optional[DashboardData] = None
+
+class ExpenseCreated(ExpenseUpdated):
+    # Ids of expenses with the same amount a few days either side
+    possible_duplicates: List[str] = []
+    # Budgets over their limit for the expense's month; crossed marks those this expense pushed over
+    budget_alerts: List[BudgetAlert] = []
+
+class BulkRowError(BaseModel):
+    row: int
+    error: str
+
+class BulkImportResult(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[BulkRowError]
+    # Rows the reader recognised as not being expenses, such as statement credits
+    skipped: int = 0
+
+class ExportFormat(str, Enum):
+    CSV = "csv"
+    XLSX = "xlsx"
+    JSONL = "jsonl"
+
+class Granularity(str, Enum):
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
 
 class AnalyticsData(BaseModel):
     spending_trends: List[dict]
@@ -83,167 +320,885 @@ class AnalyticsData(BaseModel):
 async def root():
     return {"message": "SmartSpend API - Money Made Mindful"}
 
+# Health Routes
+@api_router.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def health_ready():
+    # Startup fails fast: the app only serves once the lifespan has connected, so a 503
+    # here means the database went away later, not that it was never reached
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        raise HTTPException(status_code=503, detail="Database unavailable: {}".format(e))
+    return {"status": "ready"}
+
 # Expense Routes
-@api_router.post("/expenses", response_model=Expense)
-async def create_expense(expense_data: ExpenseCreate):
+async def expenses_changed(user_id, descriptions=None):
+    # Every expense write invalidates cached responses and feeds this worker's search index
+    namespace = "expenses:" + user_id
+    generations = await cache.bump(namespace)
+    search_index.add(user_id, descriptions, generations[namespace])
+
+async def _duplicate_conflict(user_id, doc):
+    existing = await db.expenses.find_one({"user_id": user_id, "dedup_key": doc['dedup_key']}, {"_id": 0, "id": 1})
+    raise HTTPException(status_code=409, detail={
+        "message": "Duplicate of an existing expense; resend with allow_duplicate=true to keep both",
+        "duplicate_of": existing['id'] if existing else None
+    })
+
+@api_router.post("/expenses", response_model=ExpenseCreated)
+async def create_expense(
+    expense_data: ExpenseCreate,
+    allow_duplicate: bool = False,
+    include_dashboard: bool = False,
+    user_id: str = Depends(get_user_id)
+):
     expense_dict = expense_data.dict()
-    expense_obj = Expense(**expense_dict)
-    await db.expenses.insert_one(expense_obj.dict())
-    return expense_obj
+    expense_obj = Expense(**expense_dict, user_id=user_id)
+    # Stored and rolled up by its value; the enum member would format as "ExpenseCategory.FOOD"
+    doc = {**expense_obj.dict(), "category": expense_obj.category.value}
+    # A null key keeps a deliberate repeat out of the unique dedup index
+    doc['dedup_key'] = None if allow_duplicate else dedup.fingerprint(doc)
+    try:
+        if write_buffer:
+            # Resolves once the batch holding this expense is committed and rolled up
+            month_totals = await write_buffer.insert(doc)
+        else:
+            await db.expenses.insert_one(doc)
+    except writebehind.BufferFull:
+        raise HTTPException(status_code=503, detail="Too many pending writes; retry shortly",
+                            headers={"Retry-After": "1"})
+    except DuplicateKeyError:
+        await _duplicate_conflict(user_id, doc)
+    if write_buffer:
+        possible_duplicates, budget = await asyncio.gather(
+            dedup.near_duplicates(db, doc),
+            budget_cache.get(db, user_id)
+        )
+    else:
+        # The month totals come back from the rollup $inc itself, so the budget check adds no query
+        month_totals, possible_duplicates, budget = await asyncio.gather(
+            rollups.apply_expense(db, expense_obj.dict()),
+            dedup.near_duplicates(db, doc),
+            budget_cache.get(db, user_id)
+        )
+    alerts = budgets.evaluate(budget, month_totals, doc)
+    await budgets.record_alerts(db, user_id, alerts)
+    await expenses_changed(user_id, [expense_obj.description])
+    live.publish_local(user_id, events.expense_events(None, expense_obj.dict()))
+    return ExpenseCreated(
+        **expense_obj.dict(), possible_duplicates=possible_duplicates, budget_alerts=alerts,
+        dashboard=await _dashboard_after_write(user_id, include_dashboard)
+    )
+
+# Keyset pagination on (created_at, id): newest first, id breaks ties
+EXPENSE_ORDER = [("created_at", DESCENDING), ("id", DESCENDING)]
+
+def _encode_cursor(expense):
+    token = json.dumps([expense['created_at'].isoformat(), expense['id']])
+    return base64.urlsafe_b64encode(token.encode()).decode()
+
+def _decode_cursor(cursor):
+    try:
+        created_at, expense_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = datetime.fromisoformat(created_at)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": expense_id}}
+    ]}
+
+def _expense_filter(user_id, start_date=None, end_date=None, category=None):
+    query = {"user_id": user_id}
+    if start_date or end_date:
+        query["date"] = {}
+        if start_date:
+            query["date"]["$gte"] = start_date
+        if end_date:
+            query["date"]["$lte"] = end_date
+    if category:
+        query["category"] = category
+    return query
+
+# Bulk Ingestion
+def _validation_message(error):
+    return "; ".join(
+        "{}: {}".format(".".join(str(part) for part in err['loc']), err['msg'])
+        for err in error.errors()
+    )
+
+async def _insert_chunk(chunk, result):
+    rows = [row for row, _ in chunk]
+    docs = [doc for _, doc in chunk]
+    failed = set()
+    try:
+        await db.expenses.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details['writeErrors']:
+            failed.add(write_error['index'])
+            message = write_error['errmsg']
+            if write_error['code'] == dedup.DUPLICATE_KEY:
+                message = "Duplicate of an existing expense"
+            result.errors.append(BulkRowError(row=rows[write_error['index']], error=message))
+    inserted = [doc for index, doc in enumerate(docs) if index not in failed]
+    await rollups.apply_expenses(db, inserted)
+    result.inserted += len(inserted)
+
+async def _ingest_rows(rows, chunk_size, user_id, allow_duplicates=False):
+    result = BulkImportResult(inserted=0, failed=0, errors=[])
+    chunk = []
+    descriptions = set()
+    for row_number, row in enumerate(rows, start=1):
+        if row is None:
+            result.skipped += 1
+            continue
+        try:
+            expense = ExpenseCreate(**row)
+        except (ValidationError, TypeError) as e:
+            message = _validation_message(e) if isinstance(e, ValidationError) else str(e)
+            result.errors.append(BulkRowError(row=row_number, error=message))
+            continue
+        # Build the stored document directly instead of a second Expense model per row
+        doc = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "amount": expense.amount,
+            "category": expense.category.value,
+            "description": expense.description,
+            "date": expense.date,
+            "created_at": datetime.utcnow()
+        }
+        # Repeats within the file and of earlier imports fail as row errors on the unique key
+        doc['dedup_key'] = None if allow_duplicates else dedup.fingerprint(doc)
+        chunk.append((row_number, doc))
+        descriptions.add(expense.description)
+        if len(chunk) >= chunk_size:
+            await _insert_chunk(chunk, result)
+            chunk = []
+    if chunk:
+        await _insert_chunk(chunk, result)
+    if result.inserted:
+        await expenses_changed(user_id, descriptions)
+        live.publish_local(user_id, [events.RESYNC])
+    result.failed = len(result.errors)
+    return result
+
+@api_router.post("/expenses/bulk", response_model=BulkImportResult)
+async def bulk_create_expenses(
+    rows: List[dict],
+    chunk_size: int = BULK_CHUNK_SIZE,
+    allow_duplicates: bool = False,
+    user_id: str = Depends(get_user_id)
+):
+    return await _ingest_rows(rows, max(chunk_size, 1), user_id, allow_duplicates)
+
+@api_router.post("/expenses/import", response_model=BulkImportResult)
+async def import_expenses(
+    file: UploadFile = File(...),
+    chunk_size: int = BULK_CHUNK_SIZE,
+    allow_duplicates: bool = False,
+    user_id: str = Depends(get_user_id)
+):
+    rows = importers.read_rows(file.filename or "", file.file)
+    return await _ingest_rows(rows, max(chunk_size, 1), user_id, allow_duplicates)
 
 @api_router.get("/expenses", response_model=List[Expense])
-async def get_expenses(limit: int = 50):
-    expenses = await db.expenses.find().sort("created_at", -1).limit(limit).to_list(limit)
-    return [Expense(**expense) for expense in expenses]
+async def get_expenses(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    category: Optional[ExpenseCategory] = None,
+    user_id: str = Depends(get_user_id)
+):
+    query = _expense_filter(user_id, start_date, end_date, category)
+    if cursor:
+        query.update(_decode_cursor(cursor))
+    
+    # Stored documents were validated on write, so encode them directly instead of
+    # rebuilding an Expense per row and validating it again against response_model
+    expenses = await db.expenses.find(query, {"_id": 0, "dedup_key": 0}).sort(EXPENSE_ORDER).limit(limit).to_list(limit)
+    response = ORJSONResponse(expenses)
+    
+    # A full page means there may be more; hand back an opaque token for the next one
+    if expenses and len(expenses) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(expenses[-1])
+    return response
+
+@api_router.get("/expenses/stream")
+async def stream_expenses(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    category: Optional[ExpenseCategory] = None,
+    user_id: str = Depends(get_user_id)
+):
+    query = _expense_filter(user_id, start_date, end_date, category)
+    cursor = db.expenses.find(query, {"_id": 0, "dedup_key": 0}).sort(EXPENSE_ORDER).batch_size(1000)
+    
+    async def ndjson():
+        async for expense in cursor:
+            yield orjson.dumps(expense) + b"\n"
+    
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@api_router.get("/expenses/export")
+async def export_expenses(
+    format: ExportFormat = ExportFormat.CSV,
+    gzip: bool = False,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    category: Optional[ExpenseCategory] = None,
+    user_id: str = Depends(get_user_id)
+):
+    # Rows go from the cursor through the encoder to the socket; no list of the whole export is built
+    query = _expense_filter(user_id, start_date, end_date, category)
+    # The index order, so the server streams the sort too instead of buffering it
+    cursor = db.expenses.find(query, {"_id": 0, "dedup_key": 0}).sort(EXPENSE_ORDER)
+    filename = "expenses-{}.{}".format(datetime.utcnow().date().isoformat(), format.value)
+    media_type = export.MEDIA_TYPES[format.value]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        export.encode(cursor.batch_size(export.ROWS_PER_CHUNK), format.value, gzip=gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": 'attachment; filename="{}"'.format(filename)}
+    )
+
+@api_router.get("/expenses/search", response_model=List[Expense])
+async def search_expenses(
+    q: str = "",
+    limit: int = 50,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    category: Optional[ExpenseCategory] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    user_id: str = Depends(get_user_id)
+):
+    query = _expense_filter(user_id, start_date, end_date, category)
+    if min_amount is not None or max_amount is not None:
+        query["amount"] = {}
+        if min_amount is not None:
+            query["amount"]["$gte"] = min_amount
+        if max_amount is not None:
+            query["amount"]["$lte"] = max_amount
+    if not q.strip():
+        expenses = await db.expenses.find(query, {"_id": 0, "dedup_key": 0}).sort(search.SEARCH_ORDER).limit(limit).to_list(limit)
+        return ORJSONResponse(expenses)
+    
+    namespace = "expenses:" + user_id
+    generation = (await cache.counters.counters([namespace]))[namespace]
+    index = search_index.get(db, user_id, generation)
+    return ORJSONResponse(await search.search(db, index, query, q, limit))
+
+# Archived months are read back as NDJSON for export; their totals never left the rollups
+@api_router.get("/expenses/archive")
+async def get_archived_months(user_id: str = Depends(get_user_id)):
+    return await archive.list_months(db, user_id)
+
+@api_router.get("/expenses/archive/{month}")
+async def stream_archived_month(month: str, user_id: str = Depends(get_user_id)):
+    try:
+        datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    if not await db[archive.MANIFEST_COLLECTION].count_documents({"user_id": user_id, "month": month}, limit=1):
+        raise HTTPException(status_code=404, detail="Month not archived")
+    return StreamingResponse(archive.iter_month(db, user_id, month), media_type="application/x-ndjson")
+
+# Clusters of same-amount expenses a few days apart; "exact" lists ids per repeated fingerprint, oldest first
+@api_router.get("/expenses/duplicates")
+async def get_duplicate_clusters(limit: int = 100, user_id: str = Depends(get_user_id)):
+    clusters = []
+    async for cluster in dedup.iter_clusters(db, user_id):
+        clusters.append(cluster)
+        if len(clusters) >= limit:
+            break
+    return ORJSONResponse(clusters)
+
+@api_router.post("/expenses/duplicates/merge")
+async def merge_duplicates(user_id: str = Depends(get_user_id)):
+    deleted = await dedup.merge_exact(db, user_id)
+    fingerprinted = await dedup.backfill_keys(db, user_id)
+    if deleted:
+        await expenses_changed(user_id, [])
+        live.publish_local(user_id, [events.RESYNC])
+    return {"removed": len(deleted), "fingerprinted": fingerprinted}
 
 @api_router.get("/expenses/{expense_id}", response_model=Expense)
-async def get_expense(expense_id: str):
-    expense = await db.expenses.find_one({"id": expense_id})
+async def get_expense(expense_id: str, user_id: str = Depends(get_user_id)):
+    expense = await db.expenses.find_one({"user_id": user_id, "id": expense_id})
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     return Expense(**expense)
 
-@api_router.put("/expenses/{expense_id}", response_model=Expense)
-async def update_expense(expense_id: str, expense_data: ExpenseCreate):
-    existing_expense = await db.expenses.find_one({"id": expense_id})
+@api_router.put("/expenses/{expense_id}", response_model=ExpenseUpdated)
+async def update_expense(
+    expense_id: str,
+    expense_data: ExpenseCreate,
+    allow_duplicate: bool = False,
+    include_dashboard: bool = False,
+    user_id: str = Depends(get_user_id)
+):
+    update_data = expense_data.dict()
+    dedup_key = None if allow_duplicate else dedup.fingerprint(update_data)
+    # The pre-image is needed to move the old amount out of its rollup bucket
+    try:
+        existing_expense = await db.expenses.find_one_and_update(
+            {"user_id": user_id, "id": expense_id},
+            {"$set": {**update_data, "dedup_key": dedup_key}},
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        await _duplicate_conflict(user_id, {"dedup_key": dedup_key})
     if not existing_expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     
-    update_data = expense_data.dict()
-    await db.expenses.update_one({"id": expense_id}, {"$set": update_data})
-    
-    updated_expense = await db.expenses.find_one({"id": expense_id})
-    return Expense(**updated_expense)
+    updated_expense = {**existing_expense, **update_data}
+    await rollups.move_expense(db, existing_expense, updated_expense)
+    await expenses_changed(user_id, [updated_expense['description']])
+    live.publish_local(user_id, events.expense_events(existing_expense, updated_expense))
+    return ExpenseUpdated(**updated_expense, dashboard=await _dashboard_after_write(user_id, include_dashboard))
 
 @api_router.delete("/expenses/{expense_id}")
-async def delete_expense(expense_id: str):
-    result = await db.expenses.delete_one({"id": expense_id})
-    if result.deleted_count == 0:
+async def delete_expense(expense_id: str, include_dashboard: bool = False, user_id: str = Depends(get_user_id)):
+    deleted = await db.expenses.find_one_and_delete({"user_id": user_id, "id": expense_id})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Expense not found")
-    return {"message": "Expense deleted successfully"}
+    await rollups.apply_expense(db, deleted, sign=-1)
+    await expenses_changed(user_id, [])
+    live.publish_delete(user_id, deleted)
+    result = {"message": "Expense deleted successfully"}
+    if include_dashboard:
+        result["dashboard"] = await _dashboard_after_write(user_id, True)
+    return result
+
+# Recurring Expense Routes
+@api_router.post("/recurring", response_model=RecurringExpense)
+async def create_recurring_expense(template_data: RecurringExpenseCreate, user_id: str = Depends(get_user_id)):
+    try:
+        next_run = recurring.first_run(template_data.schedule, template_data.start_date)
+        if template_data.end_date:
+            date.fromisoformat(template_data.end_date)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    template_obj = RecurringExpense(**template_data.dict(), user_id=user_id, next_run=next_run)
+    if template_obj.end_date and template_obj.end_date < next_run:
+        template_obj.active = False
+        template_obj.next_run = None
+    await db[recurring.TEMPLATE_COLLECTION].insert_one(template_obj.dict())
+    return template_obj
+
+@api_router.get("/recurring", response_model=List[RecurringExpense])
+async def get_recurring_expenses(user_id: str = Depends(get_user_id)):
+    templates = await db[recurring.TEMPLATE_COLLECTION].find(
+        {"user_id": user_id}, {"_id": 0}
+    ).sort("created_at", -1).to_list(1000)
+    return ORJSONResponse(templates)
+
+@api_router.delete("/recurring/{template_id}")
+async def delete_recurring_expense(template_id: str, user_id: str = Depends(get_user_id)):
+    # Expenses already posted from the template stay; only future periods stop
+    result = await db[recurring.TEMPLATE_COLLECTION].delete_one({"user_id": user_id, "id": template_id})
+    if not result.deleted_count:
+        raise HTTPException(status_code=404, detail="Recurring expense not found")
+    return {"message": "Recurring expense deleted successfully"}
 
 # Savings Goal Routes
 @api_router.post("/goals", response_model=SavingsGoal)
-async def create_savings_goal(goal_data: SavingsGoalCreate):
+async def create_savings_goal(goal_data: SavingsGoalCreate, user_id: str = Depends(get_user_id)):
     goal_dict = goal_data.dict()
-    goal_obj = SavingsGoal(**goal_dict)
+    goal_obj = SavingsGoal(**goal_dict, user_id=user_id)
     await db.savings_goals.insert_one(goal_obj.dict())
+    await cache.bump("goals:" + user_id)
+    live.publish_local(user_id, [events.goal_event(goal_obj.dict())])
     return goal_obj
 
 @api_router.get("/goals", response_model=List[SavingsGoal])
-async def get_savings_goals():
-    goals = await db.savings_goals.find().sort("created_at", -1).to_list(100)
-    return [SavingsGoal(**goal) for goal in goals]
+async def get_savings_goals(user_id: str = Depends(get_user_id)):
+    return ORJSONResponse(await list_savings_goals(user_id))
+
+async def list_savings_goals(user_id):
+    return await db.savings_goals.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
 
 @api_router.put("/goals/{goal_id}/add-amount")
-async def add_to_goal(goal_id: str, amount: float):
-    goal = await db.savings_goals.find_one({"id": goal_id})
-    if not goal:
+async def add_to_goal(goal_id: str, amount: float, user_id: str = Depends(get_user_id)):
+    # $inc keeps concurrent deposits from overwriting each other
+    updated_goal = await db.savings_goals.find_one_and_update(
+        {"user_id": user_id, "id": goal_id},
+        {"$inc": {"current_amount": amount}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_goal:
         raise HTTPException(status_code=404, detail="Goal not found")
     
-    new_amount = goal['current_amount'] + amount
-    await db.savings_goals.update_one({"id": goal_id}, {"$set": {"current_amount": new_amount}})
-    
-    updated_goal = await db.savings_goals.find_one({"id": goal_id})
+    await cache.bump("goals:" + user_id)
+    live.publish_local(user_id, [events.goal_event(updated_goal)])
     return SavingsGoal(**updated_goal)
 
+# Budget Routes
+@api_router.get("/budgets", response_model=Budget)
+async def get_budget(user_id: str = Depends(get_user_id)):
+    budget = await db[budgets.BUDGET_COLLECTION].find_one({"_id": user_id}, {"_id": 0})
+    return Budget(**(budget or {"user_id": user_id}))
+
+@api_router.put("/budgets", response_model=Budget)
+async def set_budget(budget_data: BudgetUpdate, user_id: str = Depends(get_user_id)):
+    budget = Budget(
+        user_id=user_id,
+        overall=budget_data.overall,
+        categories={category.value: limit for category, limit in budget_data.categories.items()},
+        updated_at=datetime.utcnow()
+    )
+    await db[budgets.BUDGET_COLLECTION].replace_one({"_id": user_id}, budget.dict(), upsert=True)
+    budget_cache.invalidate(user_id)
+    await cache.bump("budgets:" + user_id)
+    return budget
+
+@api_router.get("/budgets/status")
+async def get_budget_status(month: Optional[str] = None, user_id: str = Depends(get_user_id)):
+    return await compute_budget_status(user_id, month)
+
+async def compute_budget_status(user_id, month=None):
+    month = month or datetime.utcnow().strftime("%Y-%m")
+    month_totals, budget = await asyncio.gather(
+        db[rollups.MONTH_COLLECTION].find_one({"_id": rollups.month_id(user_id, month)}, {"_id": 0}),
+        budget_cache.get(db, user_id)
+    )
+    month_totals = month_totals or {"month": month, "total": 0.0, "count": 0, "categories": {}}
+    return {
+        "month": month,
+        "limits": budgets.limits(budget),
+        "spent": {"overall": month_totals['total'], **month_totals.get('categories', {})},
+        "alerts": budgets.evaluate(budget, month_totals)
+    }
+
+@api_router.get("/budgets/alerts", response_model=List[BudgetAlert])
+async def get_budget_alerts(month: Optional[str] = None, user_id: str = Depends(get_user_id)):
+    alerts = await budgets.list_alerts(db, user_id, month)
+    return [BudgetAlert(**alert, crossed=True) for alert in alerts]
+
 # Dashboard Route
+def _dashboard_namespaces(user_id):
+    return ("expenses:" + user_id, "goals:" + user_id, "budgets:" + user_id, "forecasts")
+
 @api_router.get("/dashboard", response_model=DashboardData)
-async def get_dashboard_data():
-    from datetime import datetime, timedelta
-    
+async def get_dashboard_data(request: Request, user_id: str = Depends(get_user_id)):
+    # The date is part of the key because "today" and "this month" roll over without a write
+    today = datetime.utcnow().date().isoformat()
+    return await cache.respond(
+        request, "dashboard", _dashboard_namespaces(user_id),
+        lambda: compute_dashboard_data(user_id), extra=(user_id, today)
+    )
+
+async def _dashboard_body(user_id):
+    # Same cache entry as GET /dashboard, so a write that returns it also warms the next fetch
+    today = datetime.utcnow().date().isoformat()
+    _, body = await cache.body(
+        "dashboard", _dashboard_namespaces(user_id), lambda: compute_dashboard_data(user_id), extra=(user_id, today)
+    )
+    return body
+
+async def _dashboard_after_write(user_id, include_dashboard):
+    # Saves the client the dashboard fetch it would make right after the write
+    if not include_dashboard:
+        return None
+    return orjson.loads(await _dashboard_body(user_id))
+
+async def compute_dashboard_data(user_id):
     today = datetime.utcnow().date().isoformat()
     month_start = datetime.utcnow().date().replace(day=1).isoformat()
     
-    # Get month and today expenses
-    monthly_expenses = await db.expenses.find({"date": {"$gte": month_start}}).to_list(1000)
-    today_expenses = await db.expenses.find({"date": today}).to_list(1000)
-    
-    total_month = sum(exp['amount'] for exp in monthly_expenses)
-    total_today = sum(exp['amount'] for exp in today_expenses)
-    
-    # Category breakdown
-    category_breakdown = {}
-    for exp in monthly_expenses:
-        cat = exp['category']
-        category_breakdown[cat] = category_breakdown.get(cat, 0) + exp['amount']
+    # Month total, today total and category breakdown from the daily rollups
+    pipeline = [
+        {"$match": {"user_id": user_id, "day": {"$gte": month_start}, "count": {"$gt": 0}}},
+        {"$facet": {
+            "month": [
+                {"$group": {"_id": None, "total": {"$sum": "$total"}}}
+            ],
+            "today": [
+                {"$match": {"day": today}},
+                {"$group": {"_id": None, "total": {"$sum": "$total"}}}
+            ],
+            "by_category": [
+                {"$group": {"_id": "$category", "total": {"$sum": "$total"}}}
+            ]
+        }}
+    ]
+    totals, recent_expenses, projection, budget = await asyncio.gather(
+        db[rollups.ROLLUP_COLLECTION].aggregate(pipeline).to_list(1),
+        # Recent expenses (last 5)
+        db.expenses.find({"user_id": user_id}, {"_id": 0, "dedup_key": 0}).sort(EXPENSE_ORDER).limit(5).to_list(5),
+        # Precomputed by the forecast job, so this is a single _id lookup
+        forecast.get_forecast(db, user_id),
+        budget_cache.get(db, user_id)
+    )
+    totals = totals[0]
     
-    # Recent expenses (last 5)
-    recent = await db.expenses.find().sort("created_at", -1).limit(5).to_list(5)
-    recent_expenses = [Expense(**exp) for exp in recent]
+    total_month = totals['month'][0]['total'] if totals['month'] else 0
+    total_today = totals['today'][0]['total'] if totals['today'] else 0
+    category_breakdown = {row['_id']: row['total'] for row in totals['by_category']}
     
-    monthly_limit = 5000.0  # Default limit
+    overall = (budget or {}).get('overall')
+    monthly_limit = overall if overall is not None else DEFAULT_MONTHLY_LIMIT
     remaining_budget = monthly_limit - total_month
+    month_totals = {"month": month_start[:7], "total": total_month, "categories": category_breakdown}
     
-    return DashboardData(
-        total_expenses_month=total_month,
-        total_expenses_today=total_today,
-        expenses_by_category=category_breakdown,
-        recent_expenses=recent_expenses,
-        monthly_limit=monthly_limit,
-        remaining_budget=remaining_budget
-    )
+    return {
+        "total_expenses_month": total_month,
+        "total_expenses_today": total_today,
+        "expenses_by_category": category_breakdown,
+        "recent_expenses": recent_expenses,
+        "monthly_limit": monthly_limit,
+        "remaining_budget": remaining_budget,
+        "forecast": projection,
+        "budget_alerts": budgets.evaluate(budget, month_totals)
+    }
+
+# Live Events
+# EventSource cannot send headers, so the stream also takes the token as a query parameter
+async def get_stream_user_id(token: Optional[str] = None, authorization: Optional[str] = Header(None)):
+    return _verified_user_id(token or _bearer(authorization))
+
+@api_router.get("/events")
+async def stream_events(user_id: str = Depends(get_stream_user_id)):
+    async def sse():
+        queue = live.subscribe(user_id)
+        try:
+            yield "event: ready\ndata: {}\n\n".format(orjson.dumps({"source": live.source}).decode())
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield "event: {}\ndata: {}\n\n".format(event['type'], orjson.dumps(event).decode())
+        finally:
+            live.unsubscribe(user_id, queue)
+
+    # X-Accel-Buffering stops nginx from holding events back in its proxy buffer
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(sse(), media_type="text/event-stream", headers=headers)
 
 # Analytics Route
+def _bucket_start(day, granularity):
+    if granularity == Granularity.WEEK:
+        return day - timedelta(days=day.weekday())
+    if granularity == Granularity.MONTH:
+        return day.replace(day=1)
+    return day
+
+def _next_bucket(day, granularity):
+    if granularity == Granularity.WEEK:
+        return day + timedelta(days=7)
+    if granularity == Granularity.MONTH:
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+def _analytics_window(start, end, tz):
+    try:
+        zone = ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail="Unknown timezone")
+    try:
+        # "Today" is resolved in the caller's timezone; expense dates are local calendar days
+        end_day = date.fromisoformat(end) if end else datetime.now(zone).date()
+        # The default window is the 30 days ending on end_day, both ends included
+        start_day = date.fromisoformat(start) if start else end_day - timedelta(days=29)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be YYYY-MM-DD")
+    if start_day > end_day:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return start_day, end_day
+
 @api_router.get("/analytics", response_model=AnalyticsData)
-async def get_analytics():
-    from datetime import datetime, timedelta
-    
-    # Last 30 days for trends
-    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-    expenses = await db.expenses.find({"created_at": {"$gte": thirty_days_ago}}).to_list(1000)
-    
-    # Daily spending trends
-    daily_spending = {}
-    category_totals = {}
+async def get_analytics(
+    request: Request,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    granularity: Granularity = Granularity.DAY,
+    tz: str = "UTC",
+    user_id: str = Depends(get_user_id)
+):
+    start_day, end_day = _analytics_window(start, end, tz)
+    return await cache.respond(
+        request, "analytics", ("expenses:" + user_id, "goals:" + user_id),
+        lambda: compute_analytics(user_id, start_day, end_day, granularity),
+        extra=(user_id, start_day, end_day)
+    )
+
+async def compute_analytics(user_id, start_day, end_day, granularity=Granularity.DAY):
+    # Seven days each, end_day included: this week is end_day-6..end_day, last week the seven before
+    this_week_start = (end_day - timedelta(days=6)).isoformat()
+    last_week_start = (end_day - timedelta(days=13)).isoformat()
     
-    for exp in expenses:
-        exp_date = exp['created_at'].date().isoformat()
-        daily_spending[exp_date] = daily_spending.get(exp_date, 0) + exp['amount']
-        
-        cat = exp['category']
-        category_totals[cat] = category_totals.get(cat, 0) + exp['amount']
+    # Rollup days are calendar dates, so they are parsed and truncated without a
+    # timezone shift; one aggregation covers trends, categories and the summaries
+    bucket = {"$dateTrunc": {
+        "date": {"$dateFromString": {"dateString": "$day", "format": "%Y-%m-%d"}},
+        "unit": granularity.value,
+        "startOfWeek": "monday"
+    }}
+    pipeline = [
+        {"$match": {
+            "user_id": user_id,
+            "day": {"$gte": min(start_day.isoformat(), last_week_start), "$lte": end_day.isoformat()},
+            "count": {"$gt": 0}
+        }},
+        {"$facet": {
+            "trends": [
+                {"$match": {"day": {"$gte": start_day.isoformat()}}},
+                {"$group": {"_id": bucket, "amount": {"$sum": "$total"}}}
+            ],
+            "categories": [
+                {"$match": {"day": {"$gte": start_day.isoformat()}}},
+                {"$group": {"_id": "$category", "total": {"$sum": "$total"}}}
+            ],
+            "summary": [
+                {"$match": {"day": {"$gte": start_day.isoformat()}}},
+                {"$group": {"_id": None, "total": {"$sum": "$total"}, "count": {"$sum": "$count"}}}
+            ],
+            "weekly": [
+                {"$match": {"day": {"$gte": last_week_start}}},
+                {"$group": {
+                    "_id": {"$cond": [{"$gte": ["$day", this_week_start]}, "this_week", "last_week"]},
+                    "total": {"$sum": "$total"}
+                }}
+            ]
+        }}
+    ]
+    result = (await db[rollups.ROLLUP_COLLECTION].aggregate(pipeline).to_list(1))[0]
     
-    # Convert to chart format
-    spending_trends = [{"date": k, "amount": v} for k, v in daily_spending.items()]
-    spending_trends.sort(key=lambda x: x['date'])
+    # Zero-fill empty buckets so charts get a continuous series
+    amounts = {row['_id'].date(): row['amount'] for row in result['trends']}
+    spending_trends = []
+    current = _bucket_start(start_day, granularity)
+    while current <= end_day:
+        spending_trends.append({"date": current.isoformat(), "amount": amounts.get(current, 0)})
+        current = _next_bucket(current, granularity)
     
-    # Monthly summary
-    total_spending = sum(exp['amount'] for exp in expenses)
-    avg_daily = total_spending / 30 if total_spending > 0 else 0
+    summary = result['summary'][0] if result['summary'] else {"total": 0, "count": 0}
+    # Both ends of the range are included, so a single-day range is one day, not zero
+    days = (end_day - start_day).days + 1
     
     monthly_summary = {
-        "total_spending": total_spending,
-        "average_daily": avg_daily,
-        "total_transactions": len(expenses)
+        "total_spending": summary['total'],
+        "average_daily": summary['total'] / days if summary['total'] > 0 else 0,
+        "total_transactions": summary['count']
     }
     
-    # Weekly comparison (simplified)
-    this_week_start = datetime.utcnow() - timedelta(days=7)
-    this_week_expenses = [exp for exp in expenses if exp['created_at'] >= this_week_start]
-    last_week_expenses = [exp for exp in expenses if exp['created_at'] < this_week_start and exp['created_at'] >= this_week_start - timedelta(days=7)]
-    
+    weekly = {row['_id']: row['total'] for row in result['weekly']}
     weekly_comparison = {
-        "this_week": sum(exp['amount'] for exp in this_week_expenses),
-        "last_week": sum(exp['amount'] for exp in last_week_expenses)
+        "this_week": weekly.get("this_week", 0),
+        "last_week": weekly.get("last_week", 0)
     }
     
     return AnalyticsData(
         spending_trends=spending_trends,
-        category_breakdown=category_totals,
+        category_breakdown={row['_id']: row['total'] for row in result['categories']},
         monthly_summary=monthly_summary,
         weekly_comparison=weekly_comparison
     )
 
+# Batch Route
+# Each resolver takes the sub-request's query parameters and returns an encoded JSON body
+async def _batch_dashboard(user_id, params):
+    return await _dashboard_body(user_id)
+
+async def _batch_analytics(user_id, params):
+    start_day, end_day = _analytics_window(params.get('start'), params.get('end'), params.get('tz', "UTC"))
+    try:
+        granularity = Granularity(params.get('granularity', Granularity.DAY.value))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="granularity must be day, week or month")
+    # Same key as GET /analytics with these query parameters
+    _, body = await cache.body(
+        "analytics", ("expenses:" + user_id, "goals:" + user_id),
+        lambda: compute_analytics(user_id, start_day, end_day, granularity),
+        params, extra=(user_id, start_day, end_day)
+    )
+    return body
+
+async def _batch_goals(user_id, params):
+    return orjson.dumps(await list_savings_goals(user_id))
+
+async def _batch_budget_status(user_id, params):
+    return orjson.dumps(await compute_budget_status(user_id, params.get('month')))
+
+BATCH_RESOURCES = {
+    "dashboard": _batch_dashboard,
+    "analytics": _batch_analytics,
+    "goals": _batch_goals,
+    "budget_status": _batch_budget_status
+}
+
+async def _batch_part(resolver, user_id, params):
+    # A failing part is reported in place so the others still load
+    try:
+        return await resolver(user_id, params)
+    except HTTPException as e:
+        return orjson.dumps({"error": {"status_code": e.status_code, "detail": e.detail}})
+
+@api_router.post("/batch")
+async def batch(resources: Dict[str, dict] = Body(...), user_id: str = Depends(get_user_id)):
+    """Several read resources in one round trip, e.g. {"dashboard": {}, "analytics": {"granularity": "week"}}."""
+    unknown = sorted(set(resources) - set(BATCH_RESOURCES))
+    if unknown:
+        raise HTTPException(status_code=400, detail="Unknown resources: {}".format(", ".join(unknown)))
+    names = list(resources)
+    bodies = await asyncio.gather(*(
+        _batch_part(BATCH_RESOURCES[name], user_id, {k: str(v) for k, v in resources[name].items()})
+        for name in names
+    ))
+    # The parts are already encoded (cached ones straight from the cache), so they are joined rather than re-parsed
+    content = b"{" + b",".join(orjson.dumps(name) + b":" + body for name, body in zip(names, bodies)) + b"}"
+    return Response(content=content, media_type="application/json")
+
+# Admin Routes
+def _plan_stages(plan):
+    stages = [plan.get('stage')]
+    for child in plan.get('inputStages', []) + [plan.get('inputStage', {})]:
+        if child:
+            stages.extend(_plan_stages(child))
+    return stages
+
+async def _explain_query(collection, query, sort=None):
+    cursor = db[collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    plan = (await cursor.explain())['queryPlanner']['winningPlan']
+    stages = [stage for stage in _plan_stages(plan) if stage]
+    return {
+        "collection": collection,
+        "query": str(query),
+        "stages": stages,
+        "collection_scan": "COLLSCAN" in stages
+    }
+
+# Long-range reports are computed from the latest columnar snapshot, never from MongoDB
+def _report_months(start, end, today):
+    end = end or today.strftime("%Y-%m")
+    start = start or "{}-01".format(today.year)
+    try:
+        first, last = datetime.strptime(start, "%Y-%m"), datetime.strptime(end, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be YYYY-MM")
+    if first > last:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return start, end
+
+async def _run_report(compute):
+    if not report_engine.refresh():
+        raise HTTPException(status_code=503, detail="No report snapshot yet")
+    result = await asyncio.to_thread(compute)
+    return ORJSONResponse({"as_of": report_engine.manifest['generated_at'], **result})
+
+@api_router.get("/reports/yoy")
+async def get_year_over_year(years: int = 3, ytd: bool = False, user_id: str = Depends(get_user_id)):
+    if not 1 <= years <= 20:
+        raise HTTPException(status_code=400, detail="years must be between 1 and 20")
+    today = datetime.utcnow().date()
+    return await _run_report(lambda: report_engine.year_over_year(user_id, years, today, ytd))
+
+@api_router.get("/reports/pivot")
+async def get_category_pivot(
+    start: Optional[str] = None, end: Optional[str] = None, user_id: str = Depends(get_user_id)
+):
+    start, end = _report_months(start, end, datetime.utcnow().date())
+    return await _run_report(lambda: report_engine.pivot(user_id, start, end))
+
+@api_router.get("/reports/percentiles")
+async def get_spend_percentiles(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    q: str = "50,90,99",
+    user_id: str = Depends(get_user_id)
+):
+    today = datetime.utcnow().date()
+    start, end = _report_months(start, end, today)
+    try:
+        quantiles = [float(value) for value in q.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="q must be comma-separated percentiles")
+    if not all(0 <= value <= 100 for value in quantiles):
+        raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+    return await _run_report(lambda: report_engine.percentiles(user_id, start, end, quantiles, today))
+
+@api_router.get("/admin/indexes", dependencies=[Depends(require_admin)])
+async def get_index_diagnostics():
+    today = datetime.utcnow().date()
+    month_start = today.replace(day=1).isoformat()
+    
+    usage = {}
+    for collection in ("expenses", "savings_goals", rollups.ROLLUP_COLLECTION):
+        stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+        usage[collection] = [
+            {"name": stat['name'], "key": stat['key'], "ops": stat['accesses']['ops']}
+            for stat in stats
+        ]
+    
+    # The hot queries issued by the expense, goal, dashboard and analytics routes
+    user = {"user_id": DEFAULT_USER_ID}
+    plans = [
+        await _explain_query("expenses", {**user, "id": ""}),
+        await _explain_query("expenses", user, EXPENSE_ORDER),
+        await _explain_query("expenses", {**user, "date": {"$gte": month_start}}),
+        await _explain_query("expenses", {**user, "description": {"$in": [""]}}, search.SEARCH_ORDER),
+        await _explain_query("savings_goals", {**user, "id": ""}),
+        await _explain_query("savings_goals", user, [("created_at", -1)]),
+        await _explain_query(rollups.ROLLUP_COLLECTION, {**user, "day": {"$gte": month_start}}),
+    ]
+    
+    return {
+        "index_usage": usage,
+        "query_plans": plans,
+        "collection_scans": [plan for plan in plans if plan['collection_scan']]
+    }
+
+@api_router.get("/admin/cache", dependencies=[Depends(require_admin)])
+async def get_cache_stats():
+    return cache.stats()
+
+@api_router.get("/admin/search", dependencies=[Depends(require_admin)])
+async def get_search_stats():
+    return search_index.stats()
+
+@api_router.get("/admin/writes", dependencies=[Depends(require_admin)])
+async def get_write_buffer_stats():
+    return write_buffer.stats() if write_buffer else {"enabled": False}
+
+@api_router.get("/admin/reports", dependencies=[Depends(require_admin)])
+async def get_report_stats():
+    report_engine.refresh()
+    return report_engine.info()
+
+@api_router.get("/admin/events", dependencies=[Depends(require_admin)])
+async def get_event_stats():
+    return live.stats()
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Prometheus scrape endpoint, served outside /api so it is not proxied publicly
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics.metrics_response()
+
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    # The browser hides response headers from cross-origin scripts unless they are listed
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Configure logging
@@ -253,6 +1208,126 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
+async def connect_db_client():
+    global client, db
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[metrics.command_listener], **MONGO_POOL_OPTIONS)
+    db = client[os.environ['DB_NAME']]
+    # Concurrent pings open minPoolSize connections up front instead of on the first requests
+    warm_connections = max(MONGO_POOL_OPTIONS["minPoolSize"], 1)
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(warm_connections)))
+    logger.info("Connected to MongoDB with %d warm connections", warm_connections)
+
+async def ensure_indexes():
+    # create_index is a no-op when an identical index already exists. Every index
+    # leads with user_id; unique ones start with the shard key so they stay valid once sharded
+    await db.expenses.create_index([("user_id", ASCENDING), ("id", ASCENDING)], unique=True)
+    await db.expenses.create_index([("user_id", ASCENDING)] + EXPENSE_ORDER)
+    await db.expenses.create_index([("user_id", ASCENDING), ("date", ASCENDING), ("category", ASCENDING)])
+    await db.savings_goals.create_index([("user_id", ASCENDING), ("id", ASCENDING)], unique=True)
+    await db.savings_goals.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+    await rollups.ensure_indexes(db)
+    await archive.ensure_indexes(db)
+    await search.ensure_indexes(db)
+    await dedup.ensure_indexes(db)
+    await budgets.ensure_indexes(db)
+    await recurring.ensure_indexes(db)
+
+# One-off upgrades of existing data, held by a renewed lease so one worker runs each and a
+# crashed worker frees it within BACKFILL_LEASE_SECONDS
+BACKFILL_LEASE_SECONDS = 120
+
+async def backfill_tenancy():
+    # Documents written before per-user data go to DEFAULT_USER_ID, as `python tenancy.py backfill` would
+    try:
+        if not await tenancy.needs_backfill(db):
+            return
+        async with locks.held(db, "tenancy-backfill", BACKFILL_LEASE_SECONDS) as leader:
+            if leader:
+                logger.info("Assigning pre-tenancy documents to %s", DEFAULT_USER_ID)
+                await tenancy.backfill(db, DEFAULT_USER_ID)
+    except Exception:
+        logger.exception("Tenancy backfill failed; run `python tenancy.py backfill`")
+
+async def backfill_rollups():
+    # Installs that predate the rollups get them built once
+    try:
+        async with locks.held(db, "rollup-backfill", BACKFILL_LEASE_SECONDS) as leader:
+            if leader:
+                built = await rollups.backfill(db)
+                if built is not None:
+                    logger.info("Built %d day rollups and %d month totals from existing data", *built)
+                    # Every cached dashboard reads the forecasts namespace, so this drops them all
+                    await cache.bump("forecasts")
+    except Exception:
+        logger.exception("Rollup backfill failed; run `python rollups.py rebuild`")
+
+async def run_backfills():
+    # Tenancy first: the rollups are keyed by the user_id it assigns
+    await backfill_tenancy()
+    await backfill_rollups()
+
+def start_backfills():
+    # In the background, so a large upgrade does not hold up readiness past the entrypoint's timeout
+    app.state.backfill_task = asyncio.create_task(run_backfills())
+
+async def refresh_forecasts_periodically():
+    while True:
+        try:
+            # Every worker runs this loop, but only the lease holder does the work
+            if await locks.acquire(db, "forecast", FORECAST_REFRESH_SECONDS + 60):
+                await forecast.refresh_forecasts(db)
+                await cache.bump("forecasts")
+        except Exception:
+            logger.exception("Forecast refresh failed")
+        await asyncio.sleep(FORECAST_REFRESH_SECONDS)
+
+async def start_forecast_job():
+    if FORECAST_REFRESH_SECONDS > 0:
+        app.state.forecast_task = asyncio.create_task(refresh_forecasts_periodically())
+
+async def materialize_recurring_periodically():
+    while True:
+        try:
+            # Occurrence ids already make reposting a no-op; the lease just avoids the wasted work
+            if await locks.acquire(db, "recurring", RECURRING_INTERVAL_SECONDS + 60):
+                posted = await recurring.materialize_due(db)
+                for user_id in posted:
+                    await expenses_changed(user_id)
+                    live.publish_local(user_id, [events.RESYNC])
+        except Exception:
+            logger.exception("Recurring expense run failed")
+        await asyncio.sleep(RECURRING_INTERVAL_SECONDS)
+
+async def start_recurring_job():
+    if RECURRING_INTERVAL_SECONDS > 0:
+        app.state.recurring_task = asyncio.create_task(materialize_recurring_periodically())
+
+async def snapshot_reports_periodically():
+    while True:
+        try:
+            if await locks.acquire(db, "reports", REPORT_SNAPSHOT_SECONDS + 60):
+                manifest = await reports.snapshot(db, REPORTS_DIR)
+                logger.info("Report snapshot of %d expenses written, %d malformed rows skipped",
+                            manifest['rows'], manifest['skipped'])
+        except Exception:
+            logger.exception("Report snapshot failed")
+        await asyncio.sleep(REPORT_SNAPSHOT_SECONDS)
+
+async def start_report_job():
+    if REPORT_SNAPSHOT_SECONDS > 0:
+        app.state.report_task = asyncio.create_task(snapshot_reports_periodically())
+
+async def start_event_source():
+    app.state.events_task = await live.start(db, EVENTS_SOURCE)
+    if live.source == "local" and WEB_CONCURRENCY > 1:
+        logger.warning("No change streams: live events only reach clients of the worker that made the change")
+
 async def shutdown_db_client():
+    # Accepted writes are flushed while the client is still open
+    if write_buffer:
+        await write_buffer.close()
+    for name in ("backfill_task", "forecast_task", "recurring_task", "report_task", "events_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
     client.close()
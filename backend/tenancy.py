@@ -0,0 +1,99 @@
+"""One-off tenancy maintenance.
+
+``python tenancy.py backfill [user_id]`` assigns documents written before
+per-user partitioning to ``user_id`` (DEFAULT_USER_ID by default), drops the
+pre-tenancy indexes and rebuilds the rollups with their new user key. The
+server runs it for DEFAULT_USER_ID at startup whenever such documents exist.
+
+``python tenancy.py shard`` shards the per-user collections on keys led by
+user_id (the database must be on a sharded cluster). Sharding requires every
+unique index to start with the full shard key. ``expenses`` has two unique
+indexes, (user_id, id) and (user_id, dedup_key), so it is sharded on user_id
+alone; the other collections use their unique key.
+"""
+import asyncio
+import logging
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+
+import recurring
+import rollups
+
+# Indexes created before every key was led by user_id
+LEGACY_INDEXES = {
+    "expenses": ["id_1", "created_at_-1_id_-1", "date_1_category_1"],
+    "savings_goals": ["id_1", "created_at_-1"],
+    rollups.ROLLUP_COLLECTION: ["day_1_category_1"],
+}
+
+SHARD_KEYS = {
+    # user_id alone, the only prefix the (user_id, id) and (user_id, dedup_key) unique indexes share
+    "expenses": {"user_id": 1},
+    "savings_goals": {"user_id": 1, "id": 1},
+    rollups.ROLLUP_COLLECTION: {"user_id": 1, "day": 1, "category": 1},
+    recurring.TEMPLATE_COLLECTION: {"user_id": 1, "id": 1},
+}
+
+logger = logging.getLogger(__name__)
+
+
+async def needs_backfill(db):
+    for collection in ("expenses", "savings_goals"):
+        if await db[collection].find_one({"user_id": {"$exists": False}}, {"_id": 1}):
+            return True
+    return False
+
+
+async def backfill(db, user_id):
+    for collection in ("expenses", "savings_goals"):
+        result = await db[collection].update_many(
+            {"user_id": {"$exists": False}}, {"$set": {"user_id": user_id}}
+        )
+        logger.info("%s: assigned %d documents to %s", collection, result.modified_count, user_id)
+
+    for collection, names in LEGACY_INDEXES.items():
+        existing = await db[collection].index_information()
+        for name in names:
+            if name in existing:
+                await db[collection].drop_index(name)
+                logger.info("%s: dropped legacy index %s", collection, name)
+
+    count = await rollups.rebuild(db)
+    logger.info("Rebuilt %d rollup documents", count)
+
+
+async def shard(client, db_name):
+    await client.admin.command("enableSharding", db_name)
+    for collection, key in SHARD_KEYS.items():
+        try:
+            await client.admin.command("shardCollection", "{}.{}".format(db_name, collection), key=key)
+            print("Sharded {} on {}".format(collection, key))
+        except OperationFailure as e:
+            print("Could not shard {}: {}".format(collection, e))
+
+
+async def _main(args):
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db_name = os.environ['DB_NAME']
+    try:
+        if args[0] == "backfill":
+            default_user = os.environ.get('DEFAULT_USER_ID', 'default')
+            await backfill(client[db_name], args[1] if len(args) > 1 else default_user)
+        else:
+            await shard(client, db_name)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    if not sys.argv[1:] or sys.argv[1] not in ("backfill", "shard"):
+        print("usage: python tenancy.py backfill [user_id] | shard")
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,169 @@
+"""Write-behind buffering for single expense inserts.
+
+With WRITE_BEHIND enabled, ``POST /api/expenses`` hands its validated
+document to a per-worker queue instead of calling ``insert_one``. A flusher
+task takes everything queued, up to MAX_BATCH documents or whatever arrived
+within MAX_DELAY of the first one, and writes it with one ``insert_many``,
+one rollup ``bulk_write`` and one read of the touched month totals. Each
+writer waits on a future that resolves only after its batch has committed,
+so a 2xx still means the expense is stored; under load many requests share
+a round trip instead of each paying for one.
+
+When the queue is full, ``insert`` raises BufferFull straight away so the
+route can answer 503 rather than let latency grow without bound. Closing the
+buffer rejects new writes and flushes everything already accepted.
+"""
+import asyncio
+import logging
+
+from prometheus_client import Counter, Gauge
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+import rollups
+
+DUPLICATE_KEY = 11000
+
+BUFFERED = Gauge(
+    "smartspend_write_buffer_pending",
+    "Expenses waiting in the write-behind buffer",
+    multiprocess_mode="livesum"
+)
+FLUSHED = Counter(
+    "smartspend_write_buffer_flushes_total",
+    "Write-behind batches written"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    pass
+
+
+class WriteBehind:
+    def __init__(self, max_batch=500, max_delay=0.005, max_pending=10000):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._db = None
+        self._task = None
+        self._closing = False
+        self.batches = 0
+        self.written = 0
+        self.rejected = 0
+
+    def start(self, db):
+        self._db = db
+        self._task = asyncio.create_task(self._run())
+        return self._task
+
+    async def insert(self, doc):
+        """Queue doc and wait for its batch; returns the month totals after the write."""
+        if self._closing:
+            self.rejected += 1
+            raise BufferFull("shutting down")
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((doc, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise BufferFull("write buffer full")
+        BUFFERED.inc()
+        # shield: a client that disconnects stops waiting, but its accepted write still goes out
+        return await asyncio.shield(future)
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                logger.exception("Write-behind batch of %d failed", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                BUFFERED.dec(len(batch))
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, batch):
+        docs = [doc for doc, _ in batch]
+        errors = {}
+        try:
+            await self._db.expenses.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details['writeErrors']:
+                error_class = DuplicateKeyError if write_error['code'] == DUPLICATE_KEY else WriteError
+                errors[write_error['index']] = error_class(write_error['errmsg'], write_error['code'], write_error)
+        inserted = [doc for index, doc in enumerate(docs) if index not in errors]
+        await rollups.apply_expenses(self._db, inserted)
+
+        month_ids = {rollups.month_id(doc['user_id'], doc['date'][:7]) for doc in inserted}
+        months = {}
+        if month_ids:
+            async for month in self._db[rollups.MONTH_COLLECTION].find({"_id": {"$in": list(month_ids)}}):
+                months[month['_id']] = month
+
+        # Walk back from the committed totals so each writer sees its month as of its own expense,
+        # as apply_expense would have returned; a budget crossing is then attributed to the right one
+        results = {}
+        for index in reversed(range(len(docs))):
+            if index in errors:
+                continue
+            doc = docs[index]
+            month = months.get(rollups.month_id(doc['user_id'], doc['date'][:7]))
+            if month is None:
+                continue
+            results[index] = {**month, "categories": dict(month.get('categories') or {})}
+            month['total'] -= doc['amount']
+            month['count'] -= 1
+            categories = month.setdefault('categories', {})
+            categories[doc['category']] = categories.get(doc['category'], 0.0) - doc['amount']
+
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(results.get(index))
+        self.batches += 1
+        self.written += len(inserted)
+        FLUSHED.inc()
+
+    async def close(self):
+        # New writes get 503 from here on; everything accepted is written before the task stops
+        self._closing = True
+        if self._task:
+            await self._queue.join()
+            self._task.cancel()
+
+    def stats(self):
+        return {
+            "enabled": True,
+            "pending": self._queue.qsize(),
+            "max_pending": self._queue.maxsize,
+            "batches": self.batches,
+            "written": self.written,
+            "mean_batch": self.written / self.batches if self.batches else 0.0,
+            "rejected": self.rejected
+        }
@@ -2,6 +2,7 @@
 import requests
 import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 class SmartSpendAPITester:
@@ -121,6 +122,49 @@ class SmartSpendAPITester:
             200
         )
 
+    def test_concurrent_goal_deposits(self, goal_id, deposits=20, amount=5):
+        """Test that parallel deposits into one goal are all counted"""
+        name = "Concurrent Goal Deposits ({} x {})".format(deposits, amount)
+        self.tests_run += 1
+        print("\n🔍 Testing {}...".format(name))
+        url = "{}/api/goals/{}/add-amount".format(self.base_url, goal_id)
+
+        try:
+            start = requests.get(self.base_url + "/api/goals").json()
+            start_amount = next(goal['current_amount'] for goal in start if goal['id'] == goal_id)
+
+            with ThreadPoolExecutor(max_workers=deposits) as pool:
+                responses = list(pool.map(
+                    lambda _: requests.put(url, params={"amount": amount}),
+                    range(deposits)
+                ))
+
+            goals = requests.get(self.base_url + "/api/goals").json()
+            final_amount = next(goal['current_amount'] for goal in goals if goal['id'] == goal_id)
+            expected = start_amount + deposits * amount
+
+            success = all(r.status_code == 200 for r in responses) and abs(final_amount - expected) < 1e-6
+            if success:
+                self.tests_passed += 1
+                print("✅ Passed - Final amount: {}".format(final_amount))
+            else:
+                print("❌ Failed - Expected {}, got {}".format(expected, final_amount))
+
+            self.test_results[name] = {
+                "success": success,
+                "expected_amount": expected,
+                "final_amount": final_amount
+            }
+            return success
+
+        except Exception as e:
+            print("❌ Failed - Error: {}".format(str(e)))
+            self.test_results[name] = {
+                "success": False,
+                "error": str(e)
+            }
+            return False
+
     def test_get_analytics(self):
         """Test getting analytics data"""
         return self.run_test(
@@ -157,7 +201,7 @@ def main():
     tester.test_get_dashboard()
     
     # 5. Create a savings goal
-    tester.test_create_goal(
+    _, goal = tester.test_create_goal(
         title="Test Goal {}".format(timestamp),
         target_amount=5000
     )
@@ -165,6 +209,10 @@ def main():
     # 6. Get all goals
     tester.test_get_goals()
     
+    # 6b. Parallel deposits into the new goal must all land
+    if goal.get('id'):
+        tester.test_concurrent_goal_deposits(goal['id'])
+    
     # 7. Get analytics data
     tester.test_get_analytics()
     
@@ -0,0 +1,125 @@
+"""Synthetic expense generator for benchmarks.
+
+Amounts are log-normal per category, dates lean towards the recent past and
+towards weekends for leisure categories, and created_at lands on the expense
+date with a random time of day, so indexes and rollups see realistic skew.
+With several users, activity follows a Zipf-like curve (a few heavy users,
+a long tail of light ones).
+
+    python benchmarks/datagen.py 100000 [users]   # seeds MONGO_URL/DB_NAME from backend/.env
+"""
+import asyncio
+import math
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import jwt
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+import rollups  # noqa: E402
+
+# (category, share of transactions, median amount, spread)
+PROFILE = [
+    ("Food", 0.38, 14.0, 0.7),
+    ("Travel", 0.12, 22.0, 1.1),
+    ("Shopping", 0.16, 35.0, 0.9),
+    ("Entertainment", 0.10, 18.0, 0.8),
+    ("Healthcare", 0.05, 45.0, 1.0),
+    ("Bills", 0.08, 80.0, 0.6),
+    ("Education", 0.04, 60.0, 1.0),
+    ("Other", 0.07, 20.0, 1.2),
+]
+WEEKEND_HEAVY = {"Entertainment", "Shopping", "Travel"}
+DESCRIPTIONS = {
+    "Food": ["Groceries", "Coffee", "Lunch", "Dinner out", "Bakery"],
+    "Travel": ["Train ticket", "Taxi", "Fuel", "Parking", "Flight"],
+    "Shopping": ["Clothes", "Electronics", "Books", "Home goods"],
+    "Entertainment": ["Cinema", "Concert", "Streaming", "Games"],
+    "Healthcare": ["Pharmacy", "Dentist", "Doctor visit"],
+    "Bills": ["Electricity", "Internet", "Phone", "Rent", "Netflix"],
+    "Education": ["Course", "Textbook", "Workshop"],
+    "Other": ["Gift", "Donation", "Misc"],
+}
+
+
+def user_ids(users):
+    # A single user maps onto the API's default tenant so unauthenticated calls see the data
+    if users == 1:
+        return ["default"]
+    return ["user-{:05d}".format(k) for k in range(users)]
+
+
+def auth_headers(user_id, secret, algorithm="HS256", **claims):
+    # A bearer token for user_id, as the API verifies it when JWT_SECRET is set; admin=True for /api/admin
+    token = jwt.encode({"sub": user_id, **claims}, secret, algorithm=algorithm)
+    return {"Authorization": "Bearer {}".format(token)}
+
+
+def generate_expenses(n, days=365, seed=42, today=None, users=1):
+    rng = random.Random(seed)
+    today = today or datetime.utcnow().date()
+    categories = [row[0] for row in PROFILE]
+    weights = [row[1] for row in PROFILE]
+    params = {row[0]: (math.log(row[2]), row[3]) for row in PROFILE}
+    owners = user_ids(users)
+    owner_weights = [1.0 / (rank + 1) for rank in range(len(owners))]
+
+    for _ in range(n):
+        user_id = rng.choices(owners, owner_weights)[0]
+        category = rng.choices(categories, weights)[0]
+        # Exponential age skews towards recent days; redraw to favour weekends where it fits
+        age = min(int(rng.expovariate(3.0 / days)), days - 1)
+        day = today - timedelta(days=age)
+        if category in WEEKEND_HEAVY and day.weekday() < 5 and rng.random() < 0.4:
+            day = day + timedelta(days=5 - day.weekday())
+            if day > today:
+                day = day - timedelta(days=7)
+        mu, sigma = params[category]
+        created_at = datetime(day.year, day.month, day.day) + timedelta(seconds=rng.randrange(86400))
+        yield {
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "user_id": user_id,
+            "amount": round(rng.lognormvariate(mu, sigma), 2),
+            "category": category,
+            "description": rng.choice(DESCRIPTIONS[category]),
+            "date": day.isoformat(),
+            "created_at": created_at
+        }
+
+
+async def seed(db, n, days=365, batch_size=5000, seed=42, users=1):
+    batch = []
+    for expense in generate_expenses(n, days=days, seed=seed, users=users):
+        batch.append(expense)
+        if len(batch) >= batch_size:
+            await db.expenses.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.expenses.insert_many(batch, ordered=False)
+    await rollups.rebuild(db)
+
+
+async def _main(n, users):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(BACKEND_DIR / ".env")
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    try:
+        await seed(client[os.environ["DB_NAME"]], n, users=users)
+        print("Seeded {} expenses for {} users".format(n, users))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    ))
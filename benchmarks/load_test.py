@@ -0,0 +1,247 @@
+"""Concurrent load test for every route in api_router.
+
+Seeds a database with synthetic expenses, drives the FastAPI app in-process
+through httpx's ASGI transport and reports p50/p95/p99 latency and throughput
+per route as JSON, so runs can be diffed between commits.
+
+    python benchmarks/load_test.py --expenses 10000 --mock
+    python benchmarks/load_test.py --expenses 100000 --mongo-url mongodb://localhost:27017 \\
+        --output bench.json
+
+--mock uses mongomock-motor (pip install mongomock-motor); routes that rely on
+server-only features such as $text, $dateTrunc or $indexStats fail there and
+are counted as errors rather than stopping the run.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import datagen  # noqa: E402
+import server  # noqa: E402  (datagen puts backend/ on sys.path)
+
+
+# Random bodies repeat now and then; those are deliberate, not 409s to be counted as errors
+def _expense_body(ctx):
+    return {"json": {
+        "amount": round(random.uniform(1, 100), 2),
+        "category": random.choice(["Food", "Bills", "Travel"]),
+        "description": "Load test"
+    }, "params": {"allow_duplicate": True}}
+
+
+def _bulk_body(ctx):
+    return {"json": [_expense_body(ctx)["json"] for _ in range(100)], "params": {"allow_duplicates": True}}
+
+
+def _import_body(ctx):
+    lines = ["amount,category,description,date"] + [
+        "{:.2f},Food,Import row,{}".format(random.uniform(1, 50), ctx["today"]) for _ in range(100)
+    ]
+    return {
+        "files": {"file": ("statement.csv", "\n".join(lines).encode(), "text/csv")},
+        "params": {"allow_duplicates": True}
+    }
+
+
+# (method, route template) -> (path params, request kwargs) for one request
+REQUESTS = {
+    ("GET", "/api/"): lambda ctx: ({}, {}),
+    ("GET", "/api/health/live"): lambda ctx: ({}, {}),
+    ("GET", "/api/health/ready"): lambda ctx: ({}, {}),
+    ("POST", "/api/expenses"): lambda ctx: ({}, _expense_body(ctx)),
+    ("POST", "/api/expenses/bulk"): lambda ctx: ({}, _bulk_body(ctx)),
+    ("POST", "/api/expenses/import"): lambda ctx: ({}, _import_body(ctx)),
+    ("GET", "/api/expenses"): lambda ctx: ({}, {"params": {"limit": 50}}),
+    ("GET", "/api/expenses/stream"): lambda ctx: ({}, {"params": {"start_date": ctx["month_start"]}}),
+    ("GET", "/api/expenses/search"): lambda ctx: (
+        {}, {"params": {"q": random.choice(["netflx", "coff", "groceries"])}}
+    ),
+    ("GET", "/api/expenses/export"): lambda ctx: (
+        {}, {"params": {"format": random.choice(["csv", "jsonl", "xlsx"]), "start_date": ctx["month_start"]}}
+    ),
+    ("GET", "/api/expenses/duplicates"): lambda ctx: ({}, {"params": {"limit": 50}}),
+    ("GET", "/api/expenses/archive"): lambda ctx: ({}, {}),
+    ("GET", "/api/expenses/{expense_id}"): lambda ctx: ({"expense_id": random.choice(ctx["expense_ids"])}, {}),
+    ("PUT", "/api/expenses/{expense_id}"): lambda ctx: (
+        {"expense_id": random.choice(ctx["expense_ids"])}, _expense_body(ctx)
+    ),
+    ("DELETE", "/api/expenses/{expense_id}"): lambda ctx: ({"expense_id": ctx["deletable_ids"].pop()}, {}),
+    ("POST", "/api/recurring"): lambda ctx: ({}, {"json": {
+        "amount": 9.99, "category": "Bills", "description": "Load test subscription", "schedule": "1 * *"
+    }}),
+    ("GET", "/api/recurring"): lambda ctx: ({}, {}),
+    ("POST", "/api/goals"): lambda ctx: ({}, {"json": {"title": "Load test goal", "target_amount": 1000}}),
+    ("GET", "/api/goals"): lambda ctx: ({}, {}),
+    ("PUT", "/api/goals/{goal_id}/add-amount"): lambda ctx: (
+        {"goal_id": ctx["goal_id"]}, {"params": {"amount": 1}}
+    ),
+    ("GET", "/api/budgets"): lambda ctx: ({}, {}),
+    ("PUT", "/api/budgets"): lambda ctx: ({}, {"json": {"overall": 5000, "categories": {"Food": 800, "Bills": 1500}}}),
+    ("GET", "/api/budgets/status"): lambda ctx: ({}, {}),
+    ("GET", "/api/budgets/alerts"): lambda ctx: ({}, {}),
+    ("GET", "/api/dashboard"): lambda ctx: ({}, {}),
+    ("POST", "/api/batch"): lambda ctx: ({}, {"json": {"dashboard": {}, "analytics": {}, "goals": {}}}),
+    ("GET", "/api/analytics"): lambda ctx: ({}, {}),
+    ("GET", "/api/reports/yoy"): lambda ctx: ({}, {"params": {"years": 3}}),
+    ("GET", "/api/reports/pivot"): lambda ctx: ({}, {}),
+    ("GET", "/api/reports/percentiles"): lambda ctx: ({}, {}),
+    ("GET", "/api/admin/indexes"): lambda ctx: ({}, {"headers": ctx["admin_headers"]}),
+    ("GET", "/api/admin/cache"): lambda ctx: ({}, {"headers": ctx["admin_headers"]}),
+    ("GET", "/api/admin/search"): lambda ctx: ({}, {"headers": ctx["admin_headers"]}),
+    ("GET", "/api/admin/events"): lambda ctx: ({}, {"headers": ctx["admin_headers"]}),
+    ("GET", "/api/admin/reports"): lambda ctx: ({}, {"headers": ctx["admin_headers"]}),
+    ("GET", "/api/admin/writes"): lambda ctx: ({}, {"headers": ctx["admin_headers"]}),
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_route(http, method, template, factory, ctx, requests, concurrency):
+    latencies = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            path_params, kwargs = factory(ctx)
+            start = time.perf_counter()
+            try:
+                response = await http.request(method, template.format(**path_params), **kwargs)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            if failed:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "method": method,
+        "route": template,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / elapsed if elapsed else None,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args):
+    if args.mock:
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url)
+
+    server.client = client
+    server.db = client[args.db_name]
+    await server.db.expenses.drop()
+    await server.db.savings_goals.drop()
+    await server.db[server.rollups.ROLLUP_COLLECTION].drop()
+    await server.ensure_indexes()
+
+    print("Seeding {} expenses for {} users...".format(args.expenses, args.users), file=sys.stderr)
+    await datagen.seed(server.db, args.expenses, users=args.users)
+
+    # Requests act as the heaviest user, so per-user queries see the largest partition
+    user_id = datagen.user_ids(args.users)[0]
+    today = datetime.utcnow().date()
+    sample = await server.db.expenses.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$sample": {"size": 1000}}
+    ]).to_list(1000)
+    ids = [row["id"] for row in sample]
+    goal = server.SavingsGoal(title="Benchmark goal", target_amount=10000, user_id=user_id)
+    await server.db.savings_goals.insert_one(goal.dict())
+    ctx = {
+        "today": today.isoformat(),
+        "month_start": today.replace(day=1).isoformat(),
+        "expense_ids": ids[: len(ids) // 2],
+        "deletable_ids": ids[len(ids) // 2:],
+        "goal_id": goal.id,
+    }
+
+    results = []
+    skipped = []
+    # An exception in a route (say an operator mongomock lacks) is a 500 for that request, not the end of the run
+    transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+    # The user comes from a verified token; a secret is set for the run so requests act as user_id
+    server.JWT_SECRET = server.JWT_SECRET or "load-test-secret-of-at-least-32-bytes"
+    headers = datagen.auth_headers(user_id, server.JWT_SECRET, server.JWT_ALGORITHM)
+    ctx["admin_headers"] = datagen.auth_headers(user_id, server.JWT_SECRET, server.JWT_ALGORITHM, admin=True)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers, timeout=None) as http:
+        for route in server.api_router.routes:
+            for method in sorted(route.methods):
+                factory = REQUESTS.get((method, route.path))
+                if factory is None:
+                    skipped.append("{} {}".format(method, route.path))
+                    continue
+                requests = args.requests
+                if method == "DELETE":
+                    requests = min(requests, len(ctx["deletable_ids"]))
+                if not requests:
+                    skipped.append("{} {}".format(method, route.path))
+                    continue
+                print("{} {}".format(method, route.path), file=sys.stderr)
+                results.append(await run_route(
+                    http, method, route.path, factory, ctx, requests, args.concurrency
+                ))
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "backend": "mongomock" if args.mock else args.mongo_url,
+        "expenses": args.expenses,
+        "users": args.users,
+        "requests_per_route": args.requests,
+        "concurrency": args.concurrency,
+        "routes": results,
+        "skipped_routes": skipped,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--expenses", type=int, default=10000, help="seed size, e.g. 10000, 100000, 1000000")
+    parser.add_argument("--users", type=int, default=1, help="spread the seed across this many users")
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="smartspend_bench")
+    parser.add_argument("--mock", action="store_true", help="use mongomock-motor instead of a real server")
+    parser.add_argument("--output", help="write the JSON report to this file as well")
+    asyncio.run(main(parser.parse_args()))
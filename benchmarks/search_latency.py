@@ -0,0 +1,114 @@
+"""Search latency at scale against a real MongoDB.
+
+Seeds a throwaway database (--db-name, dropped before and after) with
+--expenses rows for one user, then drives GET /api/expenses/search in-process
+with whole-word, prefix and misspelt queries. Two phases are timed: "cold",
+the searches served while the user's trigram index is still being built in
+the background ($text only), and "warm", once it is in place. The JSON report
+gives p50/p95/p99 per phase and whether warm p95 meets --target-ms (50 ms).
+$text is not available in mongomock, so there is no --mock mode.
+
+    python benchmarks/search_latency.py --mongo-url mongodb://localhost:27017 --expenses 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import datagen  # noqa: E402
+import server  # noqa: E402  (datagen puts backend/ on sys.path)
+from load_test import _git_commit, percentile  # noqa: E402
+
+QUERIES = ["groceries", "coffee", "netflx", "coff", "grocer", "train tiket", "electricty", "dinner"]
+
+
+async def timed_searches(http, requests, concurrency):
+    latencies = []
+    errors = 0
+    pending = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            start = time.perf_counter()
+            response = await http.get("/api/expenses/search", params={"q": random.choice(QUERIES)})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def main(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(args.mongo_url)
+    server.client = client
+    server.db = client[args.db_name]
+    user_id = datagen.user_ids(1)[0]
+    server.JWT_SECRET = server.JWT_SECRET or "search-latency-secret-of-at-least-32-bytes"
+    headers = datagen.auth_headers(user_id, server.JWT_SECRET, server.JWT_ALGORITHM)
+    try:
+        await client.drop_database(args.db_name)
+        await server.ensure_indexes()
+        print("Seeding {} expenses...".format(args.expenses), file=sys.stderr)
+        await datagen.seed(server.db, args.expenses)
+
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers,
+                                     timeout=None) as http:
+            # The first search schedules the index build; these run alongside it
+            started = time.perf_counter()
+            cold = await timed_searches(http, args.concurrency, args.concurrency)
+            while server.search_index.stats()["rebuilding"]:
+                await asyncio.sleep(0.05)
+            build_seconds = time.perf_counter() - started
+            warm = await timed_searches(http, args.requests, args.concurrency)
+    finally:
+        await client.drop_database(args.db_name)
+        client.close()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "backend": args.mongo_url,
+        "expenses": args.expenses,
+        "concurrency": args.concurrency,
+        "index_build_seconds": build_seconds,
+        "index": server.search_index.stats(),
+        "cold": cold,
+        "warm": warm,
+        "target_ms": args.target_ms,
+        "meets_target": warm["p95_ms"] <= args.target_ms,
+    }
+    print(json.dumps(report, indent=2))
+    if not report["meets_target"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--expenses", type=int, default=1000000)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--target-ms", type=float, default=50.0, help="p95 budget for a warm search")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="smartspend_search_bench")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,140 @@
+"""Throughput scaling from 1 to N worker processes.
+
+Starts the backend with uvicorn --workers for each worker count, waits for
+/api/health/ready, then drives GET /api/dashboard and POST /api/expenses over
+real HTTP and reports requests/second per route and worker count as JSON.
+Needs a reachable MongoDB (MONGO_URL from backend/.env). The servers write
+to a throwaway database (--db-name, smartspend_bench by default), which is
+dropped before and after the runs, never to the app's DB_NAME.
+
+    python benchmarks/worker_scaling.py --max-workers 8 --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import datagen  # noqa: E402
+
+# The server under test verifies bearer tokens with this secret; requests act as the default user
+JWT_SECRET = "worker-scaling-secret-of-at-least-32-bytes"
+
+ROUTES = [
+    ("GET", "/api/dashboard", {}),
+    # Every run posts the same expense, so each one is a deliberate duplicate rather than a 409
+    ("POST", "/api/expenses", {
+        "json": {"amount": 12.5, "category": "Food", "description": "Scaling run"},
+        "params": {"allow_duplicate": True}
+    }),
+]
+
+
+async def wait_ready(http, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await http.get("/api/health/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("backend did not become ready")
+
+
+async def drive(http, method, path, kwargs, requests, concurrency):
+    pending = iter(range(requests))
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            response = await http.request(method, path, **kwargs)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {"throughput_rps": requests / elapsed, "errors": errors}
+
+
+async def run(workers, args):
+    env = dict(
+        os.environ, WEB_CONCURRENCY=str(workers), FORECAST_REFRESH_SECONDS="0", JWT_SECRET=JWT_SECRET,
+        DB_NAME=args.db_name
+    )
+    if workers > 1:
+        env["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="prom_")
+    process = subprocess.Popen(
+        ["uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    limits = httpx.Limits(max_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url="http://127.0.0.1:{}".format(args.port), limits=limits, timeout=30,
+                                     headers=datagen.auth_headers("default", JWT_SECRET)) as http:
+            await wait_ready(http)
+            results = {}
+            for method, path, kwargs in ROUTES:
+                await drive(http, method, path, kwargs, args.concurrency, args.concurrency)  # warm up
+                results["{} {}".format(method, path)] = await drive(
+                    http, method, path, kwargs, args.requests, args.concurrency
+                )
+            return results
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def worker_counts(max_workers):
+    # Doubling from 1, always ending on max_workers itself
+    counts = {max_workers}
+    workers = 1
+    while workers < max_workers:
+        counts.add(workers)
+        workers *= 2
+    return sorted(counts)
+
+
+async def main(args):
+    # The servers read MONGO_URL from the same file; a variable already set takes precedence in both
+    load_dotenv(BACKEND_DIR / ".env")
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    report = {"requests_per_route": args.requests, "concurrency": args.concurrency, "runs": {}}
+    try:
+        await client.drop_database(args.db_name)
+        for workers in worker_counts(args.max_workers):
+            print("workers={}".format(workers), file=sys.stderr)
+            report["runs"][workers] = await run(workers, args)
+    finally:
+        await client.drop_database(args.db_name)
+        client.close()
+
+    baseline = report["runs"][1]
+    for workers, routes in report["runs"].items():
+        for route, result in routes.items():
+            result["speedup"] = result["throughput_rps"] / baseline[route]["throughput_rps"]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--db-name", default="smartspend_bench")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,135 @@
+"""Check that write-behind and direct expense inserts leave identical rollups.
+
+Posts the same expenses through POST /api/expenses twice, once into a fresh
+database with the write-behind buffer off and once with it on (concurrently,
+so batches really form), then compares the day rollups, the month totals and
+the budget alerts of both databases. Exits non-zero on any difference.
+
+    python benchmarks/writebehind_parity.py [--mock] [--expenses 500]
+"""
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import datagen  # noqa: E402
+import server  # noqa: E402
+import writebehind  # noqa: E402
+
+# Low enough that the generated spend crosses it, so alert attribution is compared too
+BUDGET = {"overall": 500, "categories": {"Food": 100, "Bills": 150}}
+TOLERANCE = 0.005
+
+
+def _bodies(n):
+    return [
+        {"amount": doc["amount"], "category": doc["category"], "description": doc["description"], "date": doc["date"]}
+        for doc in datagen.generate_expenses(n, days=60)
+    ]
+
+
+async def _run(client, db_name, bodies, buffered, concurrency):
+    await client.drop_database(db_name)
+    server.client = client
+    server.db = client[db_name]
+    server.budget_cache = server.budgets.BudgetCache(ttl=0)
+    await server.ensure_indexes()
+    server.write_buffer = writebehind.WriteBehind(max_batch=50, max_delay=0.01) if buffered else None
+    if server.write_buffer:
+        server.write_buffer.start(server.db)
+
+    statuses = []
+    transport = httpx.ASGITransport(app=server.app)
+    headers = datagen.auth_headers("default", server.JWT_SECRET, server.JWT_ALGORITHM) if server.JWT_SECRET else {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://parity", headers=headers, timeout=None) as http:
+        await http.put("/api/budgets", json=BUDGET)
+        pending = iter(bodies)
+
+        async def worker():
+            for body in pending:
+                response = await http.post("/api/expenses", json=body, params={"allow_duplicate": True})
+                statuses.append(response.status_code)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency if buffered else 1)))
+    if server.write_buffer:
+        await server.write_buffer.close()
+        server.write_buffer = None
+
+    db = server.db
+    days = await db[server.rollups.ROLLUP_COLLECTION].find({}, {"_id": 0}).to_list(None)
+    months = await db[server.rollups.MONTH_COLLECTION].find({}).to_list(None)
+    alerts = await db[server.budgets.ALERT_COLLECTION].find({}, {"_id": 1}).to_list(None)
+    return {
+        "statuses": sorted(set(statuses)),
+        "days": {(d["user_id"], d["day"], d["category"]): (d["total"], d["count"]) for d in days},
+        "months": {m["_id"]: m for m in months},
+        "alerts": sorted(a["_id"] for a in alerts),
+    }
+
+
+def _close(a, b):
+    return abs(a - b) <= TOLERANCE
+
+
+def compare(direct, buffered):
+    problems = []
+    for key in direct["days"].keys() | buffered["days"].keys():
+        a, b = direct["days"].get(key, (0.0, 0)), buffered["days"].get(key, (0.0, 0))
+        if not _close(a[0], b[0]) or a[1] != b[1]:
+            problems.append("day {}: direct {} buffered {}".format(key, a, b))
+    for key in direct["months"].keys() | buffered["months"].keys():
+        a, b = direct["months"].get(key), buffered["months"].get(key)
+        if a is None or b is None:
+            problems.append("month {} only in {}".format(key, "buffered" if a is None else "direct"))
+            continue
+        if a["count"] != b["count"] or not _close(a["total"], b["total"]):
+            problems.append("month {}: direct {}/{} buffered {}/{}".format(
+                key, a["total"], a["count"], b["total"], b["count"]))
+        categories = a.get("categories", {}), b.get("categories", {})
+        if categories[0].keys() != categories[1].keys() or not all(
+            _close(categories[0][name], categories[1][name]) for name in categories[0]
+        ):
+            problems.append("month {} categories: direct {} buffered {}".format(key, *categories))
+    if direct["alerts"] != buffered["alerts"]:
+        problems.append("alerts: direct {} buffered {}".format(direct["alerts"], buffered["alerts"]))
+    return problems
+
+
+async def main(args):
+    if args.mock:
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+    else:
+        from dotenv import load_dotenv
+        from motor.motor_asyncio import AsyncIOMotorClient
+        load_dotenv(BACKEND_DIR / ".env")
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+
+    bodies = _bodies(args.expenses)
+    direct = await _run(client, "smartspend_parity_direct", bodies, False, args.concurrency)
+    buffered = await _run(client, "smartspend_parity_buffered", bodies, True, args.concurrency)
+    problems = compare(direct, buffered)
+    if direct["statuses"] != [200] or buffered["statuses"] != [200]:
+        problems.append("statuses: direct {} buffered {}".format(direct["statuses"], buffered["statuses"]))
+    for problem in problems:
+        print(problem)
+    print("{} expenses, {} day rollups, {} months, {} alerts: {}".format(
+        len(bodies), len(direct["days"]), len(direct["months"]), len(direct["alerts"]),
+        "identical" if not problems else "{} differences".format(len(problems))
+    ))
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--expenses", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mock", action="store_true", help="use mongomock-motor instead of a real server")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -4,18 +4,43 @@ set -e
 # Start the FastAPI backend
 cd /backend || { echo "Backend directory not found"; exit 1; }
 
-echo "Starting FastAPI backend"
-# Start Uvicorn with proper host binding
-uvicorn server:app --host 0.0.0.0 --port 8001 &
-BACKEND_PID=$!
-
-echo "Waiting for backend to start..."
-sleep 30
+# WEB_CONCURRENCY > 1 runs several worker processes; SERVER_MODE=gunicorn uses
+# gunicorn's process manager (restarts crashed workers) instead of uvicorn's
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-1}
+if [ "$WEB_CONCURRENCY" -gt 1 ]; then
+    # Workers share Prometheus samples through this directory; stale files from
+    # a previous run would be merged into /metrics, so start clean
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
 
-if ! kill -0 $BACKEND_PID 2>/dev/null; then
-    echo "Backend failed to start at initialization, exiting"
-    exit 1
+echo "Starting FastAPI backend with $WEB_CONCURRENCY worker(s)"
+if [ "${SERVER_MODE:-uvicorn}" = "gunicorn" ]; then
+    gunicorn server:app -c gunicorn.conf.py &
+else
+    # Start Uvicorn with proper host binding
+    uvicorn server:app --host 0.0.0.0 --port 8001 --workers "$WEB_CONCURRENCY" &
 fi
+BACKEND_PID=$!
+
+echo "Waiting for backend to become ready..."
+READY_TIMEOUT=${BACKEND_READY_TIMEOUT:-60}
+elapsed=0
+until wget -q -O /dev/null http://127.0.0.1:8001/api/health/ready 2>/dev/null; do
+    if ! kill -0 $BACKEND_PID 2>/dev/null; then
+        echo "Backend failed to start at initialization, exiting"
+        exit 1
+    fi
+    if [ "$elapsed" -ge "$READY_TIMEOUT" ]; then
+        echo "Backend not ready after ${READY_TIMEOUT}s, exiting"
+        kill $BACKEND_PID
+        exit 1
+    fi
+    sleep 1
+    elapsed=$((elapsed + 1))
+done
+echo "Backend is ready"
 
 # Start Nginx
 nginx -g 'daemon off;' &
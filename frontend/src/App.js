@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import "./App.css";
 import axios from "axios";
 import { 
@@ -45,6 +45,14 @@ ChartJS.register(
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Signed in elsewhere; the backend takes the user from this token when it requires one
+const AUTH_TOKEN = localStorage.getItem('smartspend_token');
+if (AUTH_TOKEN) {
+  axios.defaults.headers.common.Authorization = `Bearer ${AUTH_TOKEN}`;
+}
+// EventSource cannot send headers, so the stream gets the token in its URL
+const EVENTS_URL = AUTH_TOKEN ? `${API}/events?token=${encodeURIComponent(AUTH_TOKEN)}` : `${API}/events`;
+
 // Category icons mapping
 const categoryIcons = {
   'Food': Utensils,
@@ -69,14 +77,76 @@ const categoryColors = {
   'Other': '#C7ECEE'
 };
 
-const Dashboard = ({ onNavigate }) => {
+const Dashboard = ({ onNavigate, prefetched }) => {
   const [dashboardData, setDashboardData] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    fetchDashboardData();
+    loadDashboard();
+
+    // Live deltas keep the dashboard current without refetching it after every change
+    const source = new EventSource(EVENTS_URL);
+    const onDelta = (event) => applyDelta(JSON.parse(event.data));
+    ['expense_created', 'expense_updated', 'expense_deleted', 'category_delta'].forEach((type) =>
+      source.addEventListener(type, onDelta)
+    );
+    source.addEventListener('resync', () => fetchDashboardData());
+    return () => source.close();
   }, []);
 
+  const applyDelta = (event) => {
+    setDashboardData((data) => {
+      if (!data) return data;
+      const recent = data.recent_expenses || [];
+      switch (event.type) {
+        case 'expense_created':
+          return { ...data, recent_expenses: [event.expense, ...recent].slice(0, 5) };
+        case 'expense_updated':
+          return { ...data, recent_expenses: recent.map((e) => (e.id === event.expense.id ? event.expense : e)) };
+        case 'expense_deleted':
+          return { ...data, recent_expenses: recent.filter((e) => e.id !== event.id) };
+        case 'category_delta': {
+          // Totals are kept per UTC day on the server
+          const today = new Date().toISOString().slice(0, 10);
+          if (event.day.slice(0, 7) !== today.slice(0, 7)) return data;
+          const byCategory = { ...data.expenses_by_category };
+          byCategory[event.category] = (byCategory[event.category] || 0) + event.amount;
+          if (byCategory[event.category] <= 0.005) delete byCategory[event.category];
+          return {
+            ...data,
+            expenses_by_category: byCategory,
+            total_expenses_month: data.total_expenses_month + event.amount,
+            total_expenses_today: data.total_expenses_today + (event.day === today ? event.amount : 0),
+            remaining_budget: data.remaining_budget - event.amount
+          };
+        }
+        default:
+          return data;
+      }
+    });
+  };
+
+  const loadDashboard = async () => {
+    // A write that just returned the dashboard saves the fetch; otherwise the first load
+    // also brings the other views' data in the same round trip
+    const dashboard = prefetched.take('dashboard');
+    if (dashboard) {
+      setDashboardData(dashboard);
+      setLoading(false);
+      return;
+    }
+    try {
+      const response = await axios.post(`${API}/batch`, { dashboard: {}, analytics: {}, goals: {} });
+      const { dashboard: data, ...views } = response.data;
+      prefetched.put(views);
+      setDashboardData(data);
+      setLoading(false);
+    } catch (error) {
+      console.error('Error fetching dashboard data:', error);
+      setLoading(false);
+    }
+  };
+
   const fetchDashboardData = async () => {
     try {
       const response = await axios.get(`${API}/dashboard`);
@@ -274,19 +344,31 @@ const AddExpense = ({ onNavigate, onExpenseAdded }) => {
     if (!amount || !description) return;
 
     setLoading(true);
+    const expense = { amount: parseFloat(amount), category, description };
+    const post = (allowDuplicate) => axios.post(`${API}/expenses`, expense, {
+      params: { include_dashboard: true, allow_duplicate: allowDuplicate }
+    });
     try {
-      await axios.post(`${API}/expenses`, {
-        amount: parseFloat(amount),
-        category,
-        description
-      });
-      
+      let response;
+      try {
+        response = await post(false);
+      } catch (error) {
+        // 409: the same expense is already recorded today; keep both only if the user says so
+        if (error.response?.status !== 409 ||
+            !window.confirm('An identical expense was already added today. Add it again?')) {
+          throw error;
+        }
+        response = await post(true);
+      }
+
       setAmount('');
       setDescription('');
-      onExpenseAdded();
+      onExpenseAdded(response.data.dashboard);
       onNavigate('dashboard');
     } catch (error) {
-      console.error('Error adding expense:', error);
+      if (error.response?.status !== 409) {
+        console.error('Error adding expense:', error);
+      }
     }
     setLoading(false);
   };
@@ -361,12 +443,18 @@ const AddExpense = ({ onNavigate, onExpenseAdded }) => {
   );
 };
 
-const Analytics = ({ onNavigate }) => {
+const Analytics = ({ onNavigate, prefetched }) => {
   const [analyticsData, setAnalyticsData] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    fetchAnalyticsData();
+    const analytics = prefetched.take('analytics');
+    if (analytics && !analytics.error) {
+      setAnalyticsData(analytics);
+      setLoading(false);
+    } else {
+      fetchAnalyticsData();
+    }
   }, []);
 
   const fetchAnalyticsData = async () => {
@@ -509,14 +597,32 @@ const Analytics = ({ onNavigate }) => {
   );
 };
 
-const Goals = ({ onNavigate }) => {
+const Goals = ({ onNavigate, prefetched }) => {
   const [goals, setGoals] = useState([]);
   const [showAddForm, setShowAddForm] = useState(false);
   const [newGoal, setNewGoal] = useState({ title: '', target_amount: '' });
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    fetchGoals();
+    const prefetchedGoals = prefetched.take('goals');
+    if (Array.isArray(prefetchedGoals)) {
+      setGoals(prefetchedGoals);
+      setLoading(false);
+    } else {
+      fetchGoals();
+    }
+
+    const source = new EventSource(EVENTS_URL);
+    source.addEventListener('goal_progress', (event) => {
+      const { goal } = JSON.parse(event.data);
+      setGoals((current) =>
+        current.some((g) => g.id === goal.id)
+          ? current.map((g) => (g.id === goal.id ? goal : g))
+          : [goal, ...current]
+      );
+    });
+    source.addEventListener('resync', () => fetchGoals());
+    return () => source.close();
   }, []);
 
   const fetchGoals = async () => {
@@ -679,24 +785,38 @@ const Goals = ({ onNavigate }) => {
 function App() {
   const [currentView, setCurrentView] = useState('dashboard');
   const [refreshTrigger, setRefreshTrigger] = useState(0);
+  // Responses fetched ahead of the view that shows them; each is used once so a view
+  // opened later fetches fresh data instead of showing a stale copy
+  const prefetchedData = useRef({});
+  const prefetched = {
+    put: (data) => Object.assign(prefetchedData.current, data),
+    take: (name) => {
+      const data = prefetchedData.current[name];
+      delete prefetchedData.current[name];
+      return data;
+    }
+  };
 
-  const handleExpenseAdded = () => {
+  const handleExpenseAdded = (dashboard) => {
+    // Analytics fetched before this expense no longer add up
+    delete prefetchedData.current.analytics;
+    if (dashboard) prefetched.put({ dashboard });
     setRefreshTrigger(prev => prev + 1);
   };
 
   return (
     <div className="App">
       {currentView === 'dashboard' && (
-        <Dashboard key={refreshTrigger} onNavigate={setCurrentView} />
+        <Dashboard key={refreshTrigger} onNavigate={setCurrentView} prefetched={prefetched} />
       )}
       {currentView === 'add-expense' && (
         <AddExpense onNavigate={setCurrentView} onExpenseAdded={handleExpenseAdded} />
       )}
       {currentView === 'analytics' && (
-        <Analytics onNavigate={setCurrentView} />
+        <Analytics onNavigate={setCurrentView} prefetched={prefetched} />
       )}
       {currentView === 'goals' && (
-        <Goals onNavigate={setCurrentView} />
+        <Goals onNavigate={setCurrentView} prefetched={prefetched} />
       )}
     </div>
   );
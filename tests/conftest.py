@@ -0,0 +1,10 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "backend"))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: long-running checks; deselect with -m 'not slow'")
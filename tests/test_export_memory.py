@@ -0,0 +1,65 @@
+"""Expense export memory stays flat as the row count grows.
+
+Every export encoder (with and without gzip) runs over synthetic rows from
+datagen, discarding the output as a client socket would, under tracemalloc.
+The peak for the large run must stay within a fixed margin of the small run;
+an encoder that buffered the export would grow with the row count instead.
+EXPORT_MEMORY_ROWS sets the large run (1,000,000 by default).
+"""
+import asyncio
+import itertools
+import os
+import tracemalloc
+
+import pytest
+
+import export
+from datagen import generate_expenses
+
+BASELINE_ROWS = 10000
+LARGE_ROWS = int(os.environ.get("EXPORT_MEMORY_ROWS", "1000000"))
+# Distinct rows generated up front and cycled, so the run times the encoders rather than datagen
+POOL_ROWS = 10000
+# Allowed peak growth from the baseline run to the large one
+MARGIN_BYTES = 2 * 1024 * 1024
+
+
+@pytest.fixture(scope="module")
+def pool():
+    return list(generate_expenses(POOL_ROWS))
+
+
+async def _rows(pool, n):
+    # Handed over one at a time, like a cursor; nothing keeps the rows already encoded
+    for doc in itertools.islice(itertools.cycle(pool), n):
+        yield doc
+
+
+async def _drain(pool, kind, gzip, n):
+    size = 0
+    async for chunk in export.encode(_rows(pool, n), kind, gzip=gzip):
+        size += len(chunk)
+    return size
+
+
+def peak_bytes(pool, kind, gzip, n):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        size = asyncio.run(_drain(pool, kind, gzip, n))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert size > 0
+    return peak
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("gzip", [False, True], ids=["plain", "gzip"])
+@pytest.mark.parametrize("kind", sorted(export.ENCODERS))
+def test_export_memory_is_flat(pool, kind, gzip):
+    small = peak_bytes(pool, kind, gzip, BASELINE_ROWS)
+    large = peak_bytes(pool, kind, gzip, LARGE_ROWS)
+    assert large - small <= MARGIN_BYTES, "{} peak grew from {:.1f}MB to {:.1f}MB over {} rows".format(
+        kind, small / 2 ** 20, large / 2 ** 20, LARGE_ROWS
+    )